@@ -0,0 +1,109 @@
+"""
+Micro-benchmark for the per-frame landmark metrics.
+
+Compares the original per-landmark path (get_point / compute_ear / iris_center,
+kept here as the reference implementation) with the vectorized kernel
+(gather_landmarks + compute_landmark_metrics) on a synthetic 478-point face
+mesh, and checks that both give the same results.
+
+Usage: python benchmark_landmarks.py [iterations]
+"""
+import sys
+import timeit
+import random
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils import (
+    gather_landmarks, compute_landmark_metrics,
+    LEFT_EYE_POINTS, RIGHT_EYE_POINTS, LEFT_IRIS, RIGHT_IRIS, NOSE_TIP, METRIC_LANDMARKS
+)
+
+FACE_MESH_POINTS = 478
+WIDTH, HEIGHT = 640, 480
+
+
+def make_face(seed: int = 0):
+    """Synthetic FaceMesh landmark list with normalized x/y coordinates"""
+    rng = random.Random(seed)
+    return [SimpleNamespace(x=rng.uniform(0.3, 0.7), y=rng.uniform(0.3, 0.7), z=0.0)
+            for _ in range(FACE_MESH_POINTS)]
+
+
+def get_point(landmarks, idx, w, h):
+    """Get landmark point as numpy array"""
+    return np.array([int(landmarks[idx].x * w), int(landmarks[idx].y * h)])
+
+
+def distance(p1, p2):
+    """Calculate distance between two points"""
+    return np.linalg.norm(p1 - p2)
+
+
+def compute_ear(landmarks, eye_points, w, h):
+    """Compute Eye Aspect Ratio for blink detection"""
+    p1, p2, p3, p4, p5, p6 = (get_point(landmarks, idx, w, h) for idx in eye_points)
+
+    vertical1 = distance(p2, p6)
+    vertical2 = distance(p3, p5)
+    horizontal = distance(p1, p4)
+
+    if horizontal == 0:
+        return 0.3  # Default value
+
+    return (vertical1 + vertical2) / (2.0 * horizontal)
+
+
+def iris_center(landmarks, iris_idx, w, h):
+    """Calculate iris center from iris landmarks"""
+    pts = [get_point(landmarks, i, w, h) for i in iris_idx]
+    return np.mean(pts, axis=0)
+
+
+def legacy_metrics(face):
+    """Per-landmark path as used by analyze_frame before the kernel"""
+    ear_left = compute_ear(face, LEFT_EYE_POINTS, WIDTH, HEIGHT)
+    ear_right = compute_ear(face, RIGHT_EYE_POINTS, WIDTH, HEIGHT)
+    left_iris = iris_center(face, LEFT_IRIS, WIDTH, HEIGHT)
+    right_iris = iris_center(face, RIGHT_IRIS, WIDTH, HEIGHT)
+    nose = get_point(face, NOSE_TIP, WIDTH, HEIGHT)
+    yaw = (nose[0] - WIDTH / 2) / WIDTH * 100
+    pitch = (nose[1] - HEIGHT / 2) / HEIGHT * 100
+    return ear_left, ear_right, np.array([left_iris, right_iris]), yaw, pitch
+
+
+def kernel_metrics(points, face):
+    """Vectorized path as used by analyze_frame"""
+    gather_landmarks(face, WIDTH, HEIGHT, points)
+    return compute_landmark_metrics(points, WIDTH, HEIGHT)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    points = np.empty((len(METRIC_LANDMARKS), 2), dtype=np.float32)
+    faces = [make_face(seed) for seed in range(8)]
+
+    # Both paths must agree before their timings mean anything
+    for face in faces:
+        expected = legacy_metrics(face)
+        actual = kernel_metrics(points, face)
+        assert abs(expected[0] - actual[0]) < 1e-4, (expected[0], actual[0])
+        assert abs(expected[1] - actual[1]) < 1e-4, (expected[1], actual[1])
+        assert np.allclose(expected[2], actual[2], atol=1e-3)
+        assert abs(expected[3] - actual[3]) < 1e-3 and abs(expected[4] - actual[4]) < 1e-3
+
+    face = faces[0]
+    legacy = min(timeit.repeat(lambda: legacy_metrics(face), number=iterations, repeat=5))
+    kernel = min(timeit.repeat(lambda: kernel_metrics(points, face), number=iterations, repeat=5))
+
+    legacy_us = legacy / iterations * 1e6
+    kernel_us = kernel / iterations * 1e6
+    print(f"legacy per-landmark path: {legacy_us:8.2f} us/frame")
+    print(f"vectorized kernel:        {kernel_us:8.2f} us/frame")
+    print(f"speedup:                  {legacy_us / kernel_us:8.2f}x "
+          f"({legacy_us - kernel_us:.2f} us saved per frame)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the answer"""
+    return re.sub(r"\s+", " ", message).strip().rstrip("?!. ").lower()
+
+
+class ChatResponseCache:
+    """
+    Content-addressed cache of chatbot answers.
+
+    Entries are keyed by a hash of the normalized question, a digest of the
+    context it was asked over and the model that answered, and live in the
+    chatbot_cache table, so they survive restarts and are shared by every
+    worker. Entries expire ttl_seconds after they were generated, and the
+    least recently used ones are evicted beyond max_entries. Hits, misses
+    and evictions are counted in chatbot_cache_stats.
+
+    Lookups only read the database: hits, misses and last-used times are
+    collected in memory and written together once usage_batch_size lookups
+    are pending, on put(), stats() and flush().
+    """
+    def __init__(self, ttl_seconds: int = 86400, max_entries: int = 1000,
+                 usage_batch_size: int = 100):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.usage_batch_size = usage_batch_size
+
+        self._hits = 0
+        self._misses = 0
+        self._last_used: Dict[str, str] = {}
+        self._usage_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def key(self, message: str, context: str, model: str) -> str:
+        """Cache key for a question asked over a context"""
+        context_digest = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        return hashlib.sha256(
+            "\0".join([normalize_message(message), context_digest, model]).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached answer for a key, if it has not expired"""
+        if not self.enabled:
+            return None
+        try:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT response FROM chatbot_cache
+                    WHERE cache_key = ? AND created_at > datetime('now', ?)
+                """, (key, f"-{self.ttl_seconds} seconds"))
+                row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error reading chatbot cache: {e}")
+            return None
+
+        with self._usage_lock:
+            if row:
+                self._hits += 1
+                self._last_used[key] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                self._misses += 1
+            pending = self._hits + self._misses
+        if pending >= self.usage_batch_size:
+            self.flush()
+        return row["response"] if row else None
+
+    def _write_usage(self, cursor):
+        """Add the usage collected since the last write (the caller commits)"""
+        with self._usage_lock:
+            hits, misses, last_used = self._hits, self._misses, self._last_used
+            self._hits, self._misses, self._last_used = 0, 0, {}
+        if hits or misses:
+            cursor.execute("UPDATE chatbot_cache_stats SET hits = hits + ?, misses = misses + ? WHERE id = 1",
+                           (hits, misses))
+        if last_used:
+            cursor.executemany(
+                "UPDATE chatbot_cache SET last_used_at = MAX(last_used_at, ?) WHERE cache_key = ?",
+                [(used_at, key) for key, used_at in last_used.items()]
+            )
+
+    def flush(self):
+        """Write the collected hit/miss counts and last-used times"""
+        try:
+            with get_db() as conn:
+                self._write_usage(conn.cursor())
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing chatbot cache usage: {e}")
+
+    def put(self, key: str, model: str, response: str):
+        """Store an answer, evicting expired and least recently used entries"""
+        if not self.enabled:
+            return
+        try:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                # Eviction below goes by last_used_at, so bring it up to date first
+                self._write_usage(cursor)
+                cursor.execute("""
+                    INSERT OR REPLACE INTO chatbot_cache (cache_key, model, response)
+                    VALUES (?, ?, ?)
+                """, (key, model, response))
+
+                cursor.execute("DELETE FROM chatbot_cache WHERE created_at <= datetime('now', ?)",
+                               (f"-{self.ttl_seconds} seconds",))
+                evicted = cursor.rowcount
+                cursor.execute("SELECT COUNT(*) FROM chatbot_cache")
+                excess = cursor.fetchone()[0] - self.max_entries
+                if excess > 0:
+                    cursor.execute("""
+                        DELETE FROM chatbot_cache WHERE cache_key IN (
+                            SELECT cache_key FROM chatbot_cache ORDER BY last_used_at LIMIT ?
+                        )
+                    """, (excess,))
+                    evicted += cursor.rowcount
+                if evicted:
+                    cursor.execute("UPDATE chatbot_cache_stats SET evictions = evictions + ? WHERE id = 1",
+                                   (evicted,))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing chatbot cache: {e}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters and the current size"""
+        self.flush()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT hits, misses, evictions FROM chatbot_cache_stats WHERE id = 1")
+            row = cursor.fetchone()
+            hits, misses, evictions = (row["hits"], row["misses"], row["evictions"]) if row else (0, 0, 0)
+            cursor.execute("SELECT COUNT(*) FROM chatbot_cache")
+            entries = cursor.fetchone()[0]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds
+        }
+
+
+# Global chatbot response cache
+chat_cache = ChatResponseCache(
+    ttl_seconds=int(os.getenv("CHATBOT_CACHE_TTL", "86400")),
+    max_entries=int(os.getenv("CHATBOT_CACHE_MAX_ENTRIES", "1000")),
+    usage_batch_size=int(os.getenv("CHATBOT_CACHE_USAGE_BATCH", "100"))
+)
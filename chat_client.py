@@ -0,0 +1,230 @@
+import asyncio
+import os
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChatBackendError(Exception):
+    """Raised when a chat backend cannot produce a response"""
+
+
+class GeminiBackend:
+    """
+    Google Gemini backend. google.generativeai is imported, configured and the
+    model created once, on first use, and then shared by every request.
+    """
+    def __init__(self, model_name: str = "gemini-2.5-flash", api_key: Optional[str] = None,
+                 timeout_seconds: float = 30.0):
+        self.model_name = model_name
+        self.api_key = api_key
+        self.timeout_seconds = timeout_seconds
+
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """The shared GenerativeModel, created lazily"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if not self.api_key:
+                        raise ChatBackendError("GEMINI_API_KEY not found in environment variables")
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+                    logger.info(f"Gemini model {self.model_name} initialized")
+        return self._model
+
+    def generate(self, prompt: str) -> str:
+        """Blocking generation; run it in ChatClient's thread pool"""
+        response = self.model.generate_content(
+            prompt, request_options={"timeout": self.timeout_seconds})
+        return response.text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Blocking generation that yields text as the model produces it"""
+        response = self.model.generate_content(
+            prompt, stream=True, request_options={"timeout": self.timeout_seconds})
+        for chunk in response:
+            yield chunk.text
+
+
+class LocalBackend:
+    """
+    Stand-in backend that answers without network access, for tests and
+    offline development. reply builds the answer from the prompt and delay
+    simulates model latency.
+    """
+    model_name = "local"
+
+    def __init__(self, reply: Optional[Callable[[str], str]] = None, delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+
+    def generate(self, prompt: str) -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        if self.reply is not None:
+            return self.reply(prompt)
+        return f"Local assistant response to a {len(prompt)} character prompt."
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """The generate() answer, one word at a time"""
+        yield from re.findall(r"\s*\S+\s*", self.generate(prompt))
+
+
+class ChatClient:
+    """
+    Process-wide chatbot client.
+
+    Generation runs in a bounded thread pool so the event loop keeps serving
+    other requests while the model answers. At most max_concurrency calls
+    run at once, further calls queue up to max_pending, and each call is
+    abandoned after timeout_seconds. Any failure raises ChatBackendError so
+    callers can fall back to the rule-based responses.
+    """
+    def __init__(self, backend, max_concurrency: int = 4, max_pending: int = 32,
+                 timeout_seconds: float = 30.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def model_name(self) -> str:
+        """Name of the model answering, part of the response cache key"""
+        return self.backend.model_name
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix="chat")
+        return self._executor
+
+    def warm_up(self):
+        """Import and configure the backend model in the background"""
+        if isinstance(self.backend, GeminiBackend) and self.backend.api_key:
+            self.executor.submit(lambda: self.backend.model)
+
+    def shutdown(self):
+        """Stop the generation threads, dropping calls that have not started yet"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def generate(self, prompt: str) -> str:
+        """Generate a response without blocking the event loop"""
+        if self._pending >= self.max_pending:
+            raise ChatBackendError("Too many chatbot requests in flight")
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            text = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, self.backend.generate, prompt),
+                self.timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            raise ChatBackendError(f"No response within {self.timeout_seconds:.0f} seconds")
+        except ChatBackendError:
+            raise
+        except Exception as e:
+            raise ChatBackendError(str(e)) from e
+        finally:
+            self._pending -= 1
+
+        if not text:
+            raise ChatBackendError("Empty response from the chat backend")
+        return text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Yield the response in pieces as the backend generates them. The backend
+        iterates in the thread pool and hands pieces over to the event loop;
+        timeout_seconds applies to the wait for each piece.
+        """
+        if self._pending >= self.max_pending:
+            raise ChatBackendError("Too many chatbot requests in flight")
+
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        closed = threading.Event()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The event loop has gone away
+                closed.set()
+
+        def produce():
+            try:
+                for text in self.backend.stream(prompt):
+                    # Stop generating once the consumer has gone
+                    if closed.is_set():
+                        return
+                    if text:
+                        put((text, None))
+                put((None, None))
+            except Exception as e:
+                put((None, e))
+
+        try:
+            self.executor.submit(produce)
+            received = False
+            while True:
+                try:
+                    text, error = await asyncio.wait_for(queue.get(), self.timeout_seconds)
+                except asyncio.TimeoutError:
+                    raise ChatBackendError(f"No response within {self.timeout_seconds:.0f} seconds")
+                if error is not None:
+                    if isinstance(error, ChatBackendError):
+                        raise error
+                    raise ChatBackendError(str(error)) from error
+                if text is None:
+                    break
+                received = True
+                yield text
+            if not received:
+                raise ChatBackendError("Empty response from the chat backend")
+        finally:
+            closed.set()
+            self._pending -= 1
+
+
+def create_backend(name: str, timeout_seconds: float):
+    """Chat backend selected by CHATBOT_BACKEND"""
+    if name == "local":
+        return LocalBackend()
+    return GeminiBackend(
+        model_name=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+        api_key=os.getenv("GEMINI_API_KEY"),
+        timeout_seconds=timeout_seconds
+    )
+
+
+CHATBOT_TIMEOUT = float(os.getenv("CHATBOT_TIMEOUT", "30"))
+
+# Global chat client shared by the chatbot endpoints
+chat_client = ChatClient(
+    create_backend(os.getenv("CHATBOT_BACKEND", "gemini"), CHATBOT_TIMEOUT),
+    max_concurrency=int(os.getenv("CHATBOT_MAX_CONCURRENCY", "4")),
+    max_pending=int(os.getenv("CHATBOT_MAX_PENDING", "32")),
+    timeout_seconds=CHATBOT_TIMEOUT
+)
@@ -1,29 +1,133 @@
 import sqlite3
 import os
+import socket
+import threading
+import time
+import uuid
 from contextlib import contextmanager
 
 DATABASE_URL = "study_app.db"
 
+# Per-connection settings. WAL lets dashboard readers run while the metrics
+# writer commits, and synchronous=NORMAL only syncs the WAL at checkpoints.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+def configure_connection(conn: sqlite3.Connection):
+    """Apply journal, sync, timeout and cache settings to a new connection"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+
 def get_db_connection():
     """Get database connection"""
-    conn = sqlite3.connect(DATABASE_URL)
+    conn = sqlite3.connect(DATABASE_URL, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    configure_connection(conn)
     return conn
 
+class ConnectionPool:
+    """
+    Thread-affine pool of configured connections. Every thread gets its own
+    connection, opened on first use and reused afterwards, so the PRAGMAs
+    are applied once per connection instead of once per request.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = get_db_connection()
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                self._connections.append(conn)
+        self._local.depth += 1
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """Hand the connection back, dropping uncommitted work of the outermost user"""
+        self._local.depth -= 1
+        if self._local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+    
+    def close_all(self):
+        """Close every pooled connection (on shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+connection_pool = ConnectionPool()
+
+# Running aggregate columns of student_courses and their definitions
+COURSE_ROLLUP_COLUMNS = {
+    "metrics_count": "INTEGER DEFAULT 0",
+    "cognitive_load_sum": "REAL DEFAULT 0.0",
+    "cognitive_load_sumsq": "REAL DEFAULT 0.0",
+    "cognitive_load_min": "REAL",
+    "cognitive_load_max": "REAL",
+    "engagement_sum": "REAL DEFAULT 0.0",
+    "engagement_sumsq": "REAL DEFAULT 0.0",
+    "engagement_min": "REAL",
+    "engagement_max": "REAL",
+    "session_seconds": "REAL DEFAULT 0.0"
+}
+
+# Downsampled metrics_history resolutions: name -> bucket size in seconds
+BUCKET_RESOLUTIONS = {"1m": 60, "15m": 900, "1d": 86400}
+
+# Metrics aggregated per bucket (avg from sum/sample_count, min and max)
+BUCKET_METRICS = ["gaze_score", "face_attention", "cognitive_load"]
+
+# Indexes for the per-student metrics_history queries: filter by student (and
+# course), then read by timestamp. Timestamps are descending so that "latest n
+# rows" and the per-student ROW_NUMBER() window read the index in order, and
+# cognitive_load makes the dashboard's latest-load lookup index-only.
+# Changes to this list need a new migration.
+METRICS_INDEX_PLAN = [
+    ("idx_metrics_history_student_time", "metrics_history(student_id, timestamp DESC, cognitive_load)"),
+    ("idx_metrics_history_student_course_time", "metrics_history(student_id, course_id, timestamp DESC)")
+]
+# Single-column indexes made redundant by the plan above
+SUPERSEDED_METRICS_INDEXES = ["idx_metrics_history_student_id"]
+
+# Engagement of a metrics_history row, as utils.calculate_engagement(face_attention)
+ENGAGEMENT_SQL = "face_attention * 0.9 + 5"
+
+# Migrations take a lease in service_leases, so that when several workers start
+# at once one of them migrates while the others wait, even though long
+# backfills commit in batches. The lease is renewed with every batch.
+MIGRATION_LEASE = "schema_migration"
+MIGRATION_LEASE_SECONDS = 300
+MIGRATION_POLL_SECONDS = 0.5
+# Students whose metrics are backfilled per transaction
+MIGRATION_BATCH_STUDENTS = int(os.getenv("MIGRATION_BATCH_STUDENTS", "100"))
+
 @contextmanager
 def get_db():
     """Context manager for database operations"""
-    conn = get_db_connection()
+    conn = connection_pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        connection_pool.release(conn)
 
-def init_database():
-    """Initialize database with required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def create_tables(cursor):
+    """Create the base tables"""
     # Create users table for authentication
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -143,7 +247,9 @@ def init_database():
     # cursor.execute("CREATE INDEX IF NOT EXISTS idx_notes_course_id ON notes(course_id)")
     # cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_history_student_id ON metrics_history(student_id)")
     # cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_history_timestamp ON metrics_history(timestamp)")
-    
+
+def seed_sample_data(cursor):
+    """Insert sample courses, users, students, teachers and enrollments into empty tables"""
     # Insert sample data
     cursor.execute("SELECT COUNT(*) FROM courses")
     if cursor.fetchone()[0] == 0:
@@ -202,223 +308,549 @@ def init_database():
                     enrollments.append((student[0], course[0]))
             
             cursor.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", enrollments)
+
+def migrate_legacy_columns(cursor):
+    """Bring databases created before the documented structure up to date"""
+    # Check if we need to migrate from old structure
+    cursor.execute("PRAGMA table_info(users)")
+    users_columns = [column[1] for column in cursor.fetchall()]
+    
+    # Update users table if needed
+    if 'password' in users_columns and 'password_hash' not in users_columns:
+        print("Migrating users table: renaming password to password_hash...")
+        cursor.execute("ALTER TABLE users RENAME COLUMN password TO password_hash")
+    
+    # Check students table structure
+    cursor.execute("PRAGMA table_info(students)")
+    students_columns = [column[1] for column in cursor.fetchall()]
+    
+    # Add missing columns to students table
+    missing_student_columns = []
+    required_student_columns = ['user_id', 'name', 'email', 'password_hash', 'cognitive_limit', 'progress', 'emotional_state', 'current_course_id', 'created_at']
+    
+    for col in required_student_columns:
+        if col not in students_columns:
+            missing_student_columns.append(col)
+    
+    if missing_student_columns:
+        print(f"Adding missing columns to students table: {missing_student_columns}")
+        for col in missing_student_columns:
+            if col == 'user_id':
+                cursor.execute("ALTER TABLE students ADD COLUMN user_id INTEGER")
+            elif col == 'email':
+                cursor.execute("ALTER TABLE students ADD COLUMN email TEXT")
+            elif col == 'password_hash':
+                cursor.execute("ALTER TABLE students ADD COLUMN password_hash TEXT")
+            elif col == 'cognitive_limit':
+                cursor.execute("ALTER TABLE students ADD COLUMN cognitive_limit INTEGER DEFAULT 70")
+            elif col == 'progress':
+                cursor.execute("ALTER TABLE students ADD COLUMN progress REAL DEFAULT 0.0")
+            elif col == 'emotional_state':
+                cursor.execute("ALTER TABLE students ADD COLUMN emotional_state TEXT DEFAULT 'normal'")
+            elif col == 'current_course_id':
+                cursor.execute("ALTER TABLE students ADD COLUMN current_course_id INTEGER")
+            elif col == 'created_at':
+                cursor.execute("ALTER TABLE students ADD COLUMN created_at TIMESTAMP")
+                # SQLite limitation: set current timestamp for existing rows
+                cursor.execute("UPDATE students SET created_at = datetime('now') WHERE created_at IS NULL")
+    
+    # Update student_courses table - recreate with new schema since SQLite doesn't support ALTER CONSTRAINT
+    cursor.execute("PRAGMA table_info(student_courses)")
+    current_columns = [column[1] for column in cursor.fetchall()]
+
+    # If we need to update the schema (add progress_percent or change status constraint)
+    needs_recreate = 'progress_percent' not in current_columns
+    
+    # Also check if the status constraint is wrong (old schema used 'active', 'completed', 'dropped')
+    if not needs_recreate:
+        # Check the CHECK constraint by trying to get the table SQL
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='student_courses'")
+        table_sql = cursor.fetchone()[0]
+        if table_sql and ("'active', 'completed', 'dropped'" in table_sql or "DEFAULT 'active'" in table_sql):
+            needs_recreate = True
+            print("Found old status constraint, recreating student_courses table...")
+    
+    if needs_recreate:
+        print("Recreating student_courses table with updated schema...")
+
+        # Keep the old rows aside while the table is recreated
+        cursor.execute("ALTER TABLE student_courses RENAME TO student_courses_old")
+
+        cursor.execute("""
+            CREATE TABLE student_courses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                enrollment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completion_date TIMESTAMP,
+                status TEXT DEFAULT 'not_started' CHECK (status IN ('not_started', 'in_progress', 'completed')),
+                progress_percent INTEGER DEFAULT 0,
+                FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+                FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE,
+                UNIQUE(student_id, course_id)
+            )
+        """)
+
+        # Copy the rows in one statement, mapping old statuses to new ones
+        # ('completed' stays the same) and starting progress at 0
+        cursor.execute("""
+            INSERT INTO student_courses
+            (id, student_id, course_id, enrollment_date, completion_date, status, progress_percent)
+            SELECT id, student_id, course_id, enrollment_date, completion_date,
+                   CASE status
+                       WHEN 'active' THEN 'not_started'
+                       WHEN 'enrolled' THEN 'in_progress'
+                       WHEN 'completed' THEN 'completed'
+                       WHEN 'in_progress' THEN 'in_progress'
+                       ELSE 'not_started'
+                   END,
+                   0
+            FROM student_courses_old
+        """)
+        cursor.execute("DROP TABLE student_courses_old")
+
+        print("✅ student_courses table recreated with updated schema")
+    # Update student_courses table with cognitive load and engagement columns
+    cursor.execute("PRAGMA table_info(student_courses)")
+    courses_columns = [column[1] for column in cursor.fetchall()]
     
+    # Add cognitive load and engagement columns if they don't exist
+    if 'avg_cognitive_load' not in courses_columns:
+        print("Adding avg_cognitive_load to student_courses table...")
+        cursor.execute("ALTER TABLE student_courses ADD COLUMN avg_cognitive_load REAL DEFAULT 0.0")
+    
+    if 'avg_engagement' not in courses_columns:
+        print("Adding avg_engagement to student_courses table...")
+        cursor.execute("ALTER TABLE student_courses ADD COLUMN avg_engagement REAL DEFAULT 0.0")
+    
+    if 'time_spent_minutes' not in courses_columns:
+        print("Adding time_spent_minutes to student_courses table...")
+        cursor.execute("ALTER TABLE student_courses ADD COLUMN time_spent_minutes INTEGER DEFAULT 0")
+    
+    # Update courses table with missing columns
+    cursor.execute("PRAGMA table_info(courses)")
+    courses_columns = [column[1] for column in cursor.fetchall()]
+    
+    missing_course_columns = []
+    required_course_columns = ['difficulty_level', 'duration_minutes', 'created_at']
+    
+    for col in required_course_columns:
+        if col not in courses_columns:
+            missing_course_columns.append(col)
+    
+    if missing_course_columns:
+        print(f"Adding missing columns to courses table: {missing_course_columns}")
+        for col in missing_course_columns:
+            if col == 'difficulty_level':
+                cursor.execute("ALTER TABLE courses ADD COLUMN difficulty_level TEXT DEFAULT 'beginner'")
+            elif col == 'duration_minutes':
+                cursor.execute("ALTER TABLE courses ADD COLUMN duration_minutes INTEGER")
+            elif col == 'created_at':
+                cursor.execute("ALTER TABLE courses ADD COLUMN created_at TIMESTAMP")
+                # SQLite limitation: set current timestamp for existing rows
+                cursor.execute("UPDATE courses SET created_at = datetime('now') WHERE created_at IS NULL")
+    
+    # Update notes table structure
+    cursor.execute("PRAGMA table_info(notes)")
+    notes_columns = [column[1] for column in cursor.fetchall()]
+    
+    missing_note_columns = []
+    required_note_columns = ['course_id', 'title', 'content', 'file_type', 'updated_at']
+    
+    for col in required_note_columns:
+        if col not in notes_columns:
+            missing_note_columns.append(col)
+    
+    if missing_note_columns:
+        print(f"Adding missing columns to notes table: {missing_note_columns}")
+        for col in missing_note_columns:
+            if col == 'course_id':
+                cursor.execute("ALTER TABLE notes ADD COLUMN course_id INTEGER")
+            elif col == 'title':
+                cursor.execute("ALTER TABLE notes ADD COLUMN title TEXT")
+            elif col == 'content':
+                cursor.execute("ALTER TABLE notes ADD COLUMN content TEXT")
+            elif col == 'file_type':
+                cursor.execute("ALTER TABLE notes ADD COLUMN file_type TEXT")
+            elif col == 'updated_at':
+                cursor.execute("ALTER TABLE notes ADD COLUMN updated_at TIMESTAMP")
+                # SQLite limitation: set current timestamp for existing rows
+                cursor.execute("UPDATE notes SET updated_at = datetime('now') WHERE updated_at IS NULL")
+    
+    # Update metrics_history table
+    cursor.execute("PRAGMA table_info(metrics_history)")
+    metrics_columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'course_id' not in metrics_columns:
+        print("Adding course_id to metrics_history table...")
+        cursor.execute("ALTER TABLE metrics_history ADD COLUMN course_id INTEGER")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_history_course_id ON metrics_history(course_id)")
+    
+    # Create indexes if they don't exist
+    indexes_to_create = [
+        ("idx_students_user_id", "students(user_id)"),
+        ("idx_teachers_user_id", "teachers(user_id)"),
+        ("idx_student_courses_student_id", "student_courses(student_id)"),
+        ("idx_student_courses_course_id", "student_courses(course_id)"),
+        ("idx_notes_student_id", "notes(student_id)"),
+        ("idx_notes_course_id", "notes(course_id)"),
+        ("idx_metrics_history_timestamp", "metrics_history(timestamp)")
+    ]
+    
+    for index_name, index_def in indexes_to_create:
+        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='index' AND name='{index_name}'")
+        if not cursor.fetchone():
+            print(f"Creating index: {index_name}")
+            cursor.execute(f"CREATE INDEX {index_name} ON {index_def}")
+
+def student_batches(cursor, table: str):
+    """Student ids found in a table, MIGRATION_BATCH_STUDENTS at a time"""
+    cursor.execute(f"SELECT DISTINCT student_id FROM {table} ORDER BY student_id")
+    student_ids = [row[0] for row in cursor.fetchall()]
+    for offset in range(0, len(student_ids), MIGRATION_BATCH_STUDENTS):
+        yield student_ids[offset:offset + MIGRATION_BATCH_STUDENTS]
+
+def commit_migration_batch(cursor):
+    """
+    Commit a backfill batch and continue in a new write transaction, so that
+    other connections get the write lock between batches
+    """
+    cursor.execute("UPDATE service_leases SET expires_at = datetime('now', ?) WHERE name = ?",
+                   (f"+{MIGRATION_LEASE_SECONDS} seconds", MIGRATION_LEASE))
+    cursor.connection.commit()
+    cursor.execute("BEGIN IMMEDIATE")
+
+def add_course_rollups(cursor):
+    """
+    Running aggregates of metrics_history per (student, course), kept up to date
+    by the metrics writer so progress endpoints don't rescan the history
+    """
+    cursor.execute("PRAGMA table_info(student_courses)")
+    courses_columns = [column[1] for column in cursor.fetchall()]
+    
+    missing_rollup_columns = [col for col in COURSE_ROLLUP_COLUMNS if col not in courses_columns]
+    if missing_rollup_columns:
+        print(f"Adding metrics rollup columns to student_courses table: {missing_rollup_columns}")
+        for col in missing_rollup_columns:
+            cursor.execute(f"ALTER TABLE student_courses ADD COLUMN {col} {COURSE_ROLLUP_COLUMNS[col]}")
+    
+    # Backfill from the existing history. The rollups are recomputed, so a
+    # backfill interrupted between batches is simply run again.
+    print("Backfilling student_courses rollups from metrics_history...")
+    for student_ids in student_batches(cursor, "student_courses"):
+        placeholders = ", ".join("?" for _ in student_ids)
+        cursor.execute(f"""
+            UPDATE student_courses SET ({', '.join(COURSE_ROLLUP_COLUMNS)}) = (
+                SELECT COUNT(*),
+                       COALESCE(SUM(cognitive_load), 0.0),
+                       COALESCE(SUM(cognitive_load * cognitive_load), 0.0),
+                       MIN(cognitive_load), MAX(cognitive_load),
+                       COALESCE(SUM({ENGAGEMENT_SQL}), 0.0),
+                       COALESCE(SUM(({ENGAGEMENT_SQL}) * ({ENGAGEMENT_SQL})), 0.0),
+                       MIN({ENGAGEMENT_SQL}), MAX({ENGAGEMENT_SQL}),
+                       COALESCE(SUM(session_duration), 0.0)
+                FROM metrics_history m
+                WHERE m.student_id = student_courses.student_id
+                  AND m.course_id = student_courses.course_id
+            )
+            WHERE student_id IN ({placeholders})
+        """, student_ids)
+        cursor.execute(f"""
+            UPDATE student_courses SET
+                avg_cognitive_load = cognitive_load_sum / metrics_count,
+                avg_engagement = engagement_sum / metrics_count
+            WHERE metrics_count > 0 AND student_id IN ({placeholders})
+        """, student_ids)
+        commit_migration_batch(cursor)
+
+def create_metrics_buckets(cursor):
+    """Time-bucketed rollups of metrics_history and their emotional state counts"""
+    # Time-bucketed rollups of metrics_history (one row per student, course and
+    # bucket for every resolution) and their emotional state counts
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='metrics_buckets'")
+    if not cursor.fetchone():
+        print("Creating metrics_buckets tables...")
+        metric_columns = ",\n".join(
+            f"{metric}_sum REAL NOT NULL, {metric}_min REAL, {metric}_max REAL"
+            for metric in BUCKET_METRICS
+        )
+        # course_id is 0 for rows without a course so that it can be part of the key
+        cursor.execute(f"""
+            CREATE TABLE metrics_buckets (
+                resolution TEXT NOT NULL,
+                student_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL DEFAULT 0,
+                bucket_start TIMESTAMP NOT NULL,
+                sample_count INTEGER NOT NULL,
+                {metric_columns},
+                session_seconds REAL NOT NULL DEFAULT 0.0,
+                PRIMARY KEY (resolution, student_id, course_id, bucket_start),
+                FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE metrics_bucket_states (
+                resolution TEXT NOT NULL,
+                student_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL DEFAULT 0,
+                bucket_start TIMESTAMP NOT NULL,
+                emotional_state TEXT NOT NULL,
+                sample_count INTEGER NOT NULL,
+                PRIMARY KEY (resolution, student_id, course_id, bucket_start, emotional_state),
+                FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+    
+    # Backfill every resolution from the existing history. Each batch replaces
+    # its students' buckets, so a backfill interrupted between batches is
+    # simply run again.
+    print("Backfilling metrics_buckets from metrics_history...")
+    metric_aggregates = ", ".join(
+        f"SUM({metric}), MIN({metric}), MAX({metric})" for metric in BUCKET_METRICS
+    )
+    for student_ids in student_batches(cursor, "metrics_history"):
+        placeholders = ", ".join("?" for _ in student_ids)
+        for resolution, seconds in BUCKET_RESOLUTIONS.items():
+            bucket_start = f"datetime(CAST(strftime('%s', timestamp) AS INTEGER) / {seconds} * {seconds}, 'unixepoch')"
+            for table in ("metrics_buckets", "metrics_bucket_states"):
+                cursor.execute(f"DELETE FROM {table} WHERE resolution = ? AND student_id IN ({placeholders})",
+                               [resolution, *student_ids])
+            cursor.execute(f"""
+                INSERT INTO metrics_buckets
+                SELECT ?, student_id, COALESCE(course_id, 0), {bucket_start} AS bucket,
+                       COUNT(*), {metric_aggregates}, COALESCE(SUM(session_duration), 0.0)
+                FROM metrics_history
+                WHERE student_id IN ({placeholders})
+                GROUP BY student_id, COALESCE(course_id, 0), bucket
+            """, [resolution, *student_ids])
+            cursor.execute(f"""
+                INSERT INTO metrics_bucket_states
+                SELECT ?, student_id, COALESCE(course_id, 0), {bucket_start} AS bucket,
+                       emotional_state, COUNT(*)
+                FROM metrics_history
+                WHERE student_id IN ({placeholders})
+                GROUP BY student_id, COALESCE(course_id, 0), bucket, emotional_state
+            """, [resolution, *student_ids])
+        commit_migration_batch(cursor)
+
+def apply_metrics_index_plan(cursor):
+    """Composite metrics_history indexes (see METRICS_INDEX_PLAN)"""
+    for index_name, index_def in METRICS_INDEX_PLAN:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {index_def}")
+    for index_name in SUPERSEDED_METRICS_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+def create_chatbot_cache(cursor):
+    """Chatbot response cache shared by every worker, with its hit/miss counters"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chatbot_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chatbot_cache_last_used ON chatbot_cache(last_used_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chatbot_cache_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            hits INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0,
+            evictions INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO chatbot_cache_stats (id) VALUES (1)")
+
+def create_note_texts(cursor):
+    """Extracted text of uploaded notes, filled at upload and backfilled on first view"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS note_texts (
+            note_id INTEGER PRIMARY KEY,
+            text BLOB NOT NULL,
+            compressed INTEGER NOT NULL DEFAULT 0,
+            extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE
+        )
+    """)
+
+def create_course_pdf_texts(cursor):
+    """Per-page text of course PDFs, valid while the file keeps its mtime and size"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS course_pdf_texts (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            page_count INTEGER NOT NULL,
+            extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS course_pdf_pages (
+            path TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            text BLOB NOT NULL,
+            compressed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (path, page)
+        ) WITHOUT ROWID
+    """)
+
+def create_extraction_jobs(cursor):
+    """Status of background text extraction jobs, readable from every worker"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS extraction_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL CHECK (kind IN ('note', 'course_pdf')),
+            target_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+            text_length INTEGER,
+            page_count INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+def add_note_extraction_errors(cursor):
+    """
+    Remember notes whose file could not be parsed, so views don't re-parse them,
+    and find a note's extraction jobs without a scan
+    """
+    cursor.execute("PRAGMA table_info(note_texts)")
+    if "error" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE note_texts ADD COLUMN error TEXT")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_extraction_jobs_target
+        ON extraction_jobs(kind, target_id, created_at)
+    """)
+
+def create_service_leases(cursor):
+    """Leases that let one server worker at a time run a periodic job"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS service_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+# Numbered schema migrations, applied in order and recorded in schema_version.
+# Every migration checks what already exists, so databases created before
+# schema_version can run all of them. Append new migrations; never renumber.
+MIGRATIONS = [
+    (1, "base tables", create_tables),
+    (2, "legacy column fixes", migrate_legacy_columns),
+    (3, "student_courses metrics rollups", add_course_rollups),
+    (4, "metrics_buckets tables", create_metrics_buckets),
+    (5, "metrics_history composite indexes", apply_metrics_index_plan),
+    (6, "chatbot response cache", create_chatbot_cache),
+    (7, "note_texts table", create_note_texts),
+    (8, "course PDF page texts", create_course_pdf_texts),
+    (9, "extraction_jobs table", create_extraction_jobs),
+    (10, "note extraction errors", add_note_extraction_errors),
+    (11, "service leases", create_service_leases)
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    """Highest applied migration, 0 for a new or unversioned database"""
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        # No schema_version table yet
+        return 0
+
+def take_migration_lease(conn, owner: str) -> bool:
+    """Take the migration lease unless another live worker holds it"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    create_service_leases(cursor)
+    cursor.execute("""
+        INSERT INTO service_leases (name, owner, expires_at)
+        VALUES (?, ?, datetime('now', ?))
+        ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE service_leases.expires_at < datetime('now')
+    """, (MIGRATION_LEASE, owner, f"+{MIGRATION_LEASE_SECONDS} seconds"))
+    taken = cursor.rowcount == 1
     conn.commit()
-    conn.close()
-    print("Database initialized successfully!")
+    return taken
 
 def migrate_database():
-    """Apply database migrations to match documented structure"""
+    """
+    Apply the migrations the database has not seen yet, each in its own
+    transaction. Raises if a migration fails.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    leased = False
     
     try:
-        # Check if we need to migrate from old structure
-        cursor.execute("PRAGMA table_info(users)")
-        users_columns = [column[1] for column in cursor.fetchall()]
-        
-        # Update users table if needed
-        if 'password' in users_columns and 'password_hash' not in users_columns:
-            print("Migrating users table: renaming password to password_hash...")
-            cursor.execute("ALTER TABLE users RENAME COLUMN password TO password_hash")
-        
-        # Check students table structure
-        cursor.execute("PRAGMA table_info(students)")
-        students_columns = [column[1] for column in cursor.fetchall()]
-        
-        # Add missing columns to students table
-        missing_student_columns = []
-        required_student_columns = ['user_id', 'name', 'email', 'password_hash', 'cognitive_limit', 'progress', 'emotional_state', 'current_course_id', 'created_at']
-        
-        for col in required_student_columns:
-            if col not in students_columns:
-                missing_student_columns.append(col)
-        
-        if missing_student_columns:
-            print(f"Adding missing columns to students table: {missing_student_columns}")
-            for col in missing_student_columns:
-                if col == 'user_id':
-                    cursor.execute("ALTER TABLE students ADD COLUMN user_id INTEGER")
-                elif col == 'email':
-                    cursor.execute("ALTER TABLE students ADD COLUMN email TEXT")
-                elif col == 'password_hash':
-                    cursor.execute("ALTER TABLE students ADD COLUMN password_hash TEXT")
-                elif col == 'cognitive_limit':
-                    cursor.execute("ALTER TABLE students ADD COLUMN cognitive_limit INTEGER DEFAULT 70")
-                elif col == 'progress':
-                    cursor.execute("ALTER TABLE students ADD COLUMN progress REAL DEFAULT 0.0")
-                elif col == 'emotional_state':
-                    cursor.execute("ALTER TABLE students ADD COLUMN emotional_state TEXT DEFAULT 'normal'")
-                elif col == 'current_course_id':
-                    cursor.execute("ALTER TABLE students ADD COLUMN current_course_id INTEGER")
-                elif col == 'created_at':
-                    cursor.execute("ALTER TABLE students ADD COLUMN created_at TIMESTAMP")
-                    # SQLite limitation: set current timestamp for existing rows
-                    cursor.execute("UPDATE students SET created_at = datetime('now') WHERE created_at IS NULL")
-        
-        # Update student_courses table - recreate with new schema since SQLite doesn't support ALTER CONSTRAINT
-        cursor.execute("PRAGMA table_info(student_courses)")
-        current_columns = [column[1] for column in cursor.fetchall()]
-
-        # If we need to update the schema (add progress_percent or change status constraint)
-        needs_recreate = 'progress_percent' not in current_columns
-        
-        # Also check if the status constraint is wrong (old schema used 'active', 'completed', 'dropped')
-        if not needs_recreate:
-            # Check the CHECK constraint by trying to get the table SQL
-            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='student_courses'")
-            table_sql = cursor.fetchone()[0]
-            if table_sql and ("'active', 'completed', 'dropped'" in table_sql or "DEFAULT 'active'" in table_sql):
-                needs_recreate = True
-                print("Found old status constraint, recreating student_courses table...")
+        # When several workers start at once one of them migrates, and the
+        # others wait for it to finish and skip
+        while get_schema_version(conn) < LATEST_SCHEMA_VERSION:
+            leased = take_migration_lease(conn, owner)
+            if leased:
+                break
+            time.sleep(MIGRATION_POLL_SECONDS)
+        else:
+            return
         
-        if needs_recreate:
-            print("Recreating student_courses table with updated schema...")
-
-            # Backup existing data
-            cursor.execute("SELECT * FROM student_courses")
-            existing_data = cursor.fetchall()
-
-            # Drop and recreate table with new schema
-            cursor.execute("DROP TABLE student_courses")
-
-            cursor.execute("""
-                CREATE TABLE student_courses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_id INTEGER NOT NULL,
-                    course_id INTEGER NOT NULL,
-                    enrollment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completion_date TIMESTAMP,
-                    status TEXT DEFAULT 'not_started' CHECK (status IN ('not_started', 'in_progress', 'completed')),
-                    progress_percent INTEGER DEFAULT 0,
-                    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
-                    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE,
-                    UNIQUE(student_id, course_id)
-                )
-            """)
-
-            # Restore data with status mapping
-            for row in existing_data:
-                old_status = row[5] if len(row) > 5 else 'active'
-                # Map old statuses to new ones
-                if old_status == 'active':
-                    new_status = 'not_started'
-                elif old_status == 'enrolled':
-                    new_status = 'in_progress'
-                else:
-                    new_status = old_status  # 'completed' stays the same
-
-                # Insert with new schema (add progress_percent=0 if not present)
-                cursor.execute("""
-                    INSERT INTO student_courses
-                    (id, student_id, course_id, enrollment_date, completion_date, status, progress_percent)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (row[0], row[1], row[2], row[3], row[4], new_status, 0))
-
-            print("✅ student_courses table recreated with updated schema")
-        # Update student_courses table with cognitive load and engagement columns
-        cursor.execute("PRAGMA table_info(student_courses)")
-        courses_columns = [column[1] for column in cursor.fetchall()]
+        current_version = get_schema_version(conn)
+        for version, name, migration in MIGRATIONS:
+            if version <= current_version:
+                continue
+            print(f"Applying migration {version}: {name}...")
+            cursor.execute("BEGIN IMMEDIATE")
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
         
-        # Add cognitive load and engagement columns if they don't exist
-        if 'avg_cognitive_load' not in courses_columns:
-            print("Adding avg_cognitive_load to student_courses table...")
-            cursor.execute("ALTER TABLE student_courses ADD COLUMN avg_cognitive_load REAL DEFAULT 0.0")
-        
-        if 'avg_engagement' not in courses_columns:
-            print("Adding avg_engagement to student_courses table...")
-            cursor.execute("ALTER TABLE student_courses ADD COLUMN avg_engagement REAL DEFAULT 0.0")
-        
-        if 'time_spent_minutes' not in courses_columns:
-            print("Adding time_spent_minutes to student_courses table...")
-            cursor.execute("ALTER TABLE student_courses ADD COLUMN time_spent_minutes INTEGER DEFAULT 0")
-        
-        # Update courses table with missing columns
-        cursor.execute("PRAGMA table_info(courses)")
-        courses_columns = [column[1] for column in cursor.fetchall()]
-        
-        missing_course_columns = []
-        required_course_columns = ['difficulty_level', 'duration_minutes', 'created_at']
-        
-        for col in required_course_columns:
-            if col not in courses_columns:
-                missing_course_columns.append(col)
-        
-        if missing_course_columns:
-            print(f"Adding missing columns to courses table: {missing_course_columns}")
-            for col in missing_course_columns:
-                if col == 'difficulty_level':
-                    cursor.execute("ALTER TABLE courses ADD COLUMN difficulty_level TEXT DEFAULT 'beginner'")
-                elif col == 'duration_minutes':
-                    cursor.execute("ALTER TABLE courses ADD COLUMN duration_minutes INTEGER")
-                elif col == 'created_at':
-                    cursor.execute("ALTER TABLE courses ADD COLUMN created_at TIMESTAMP")
-                    # SQLite limitation: set current timestamp for existing rows
-                    cursor.execute("UPDATE courses SET created_at = datetime('now') WHERE created_at IS NULL")
-        
-        # Update notes table structure
-        cursor.execute("PRAGMA table_info(notes)")
-        notes_columns = [column[1] for column in cursor.fetchall()]
-        
-        missing_note_columns = []
-        required_note_columns = ['course_id', 'title', 'content', 'file_type', 'updated_at']
-        
-        for col in required_note_columns:
-            if col not in notes_columns:
-                missing_note_columns.append(col)
-        
-        if missing_note_columns:
-            print(f"Adding missing columns to notes table: {missing_note_columns}")
-            for col in missing_note_columns:
-                if col == 'course_id':
-                    cursor.execute("ALTER TABLE notes ADD COLUMN course_id INTEGER")
-                elif col == 'title':
-                    cursor.execute("ALTER TABLE notes ADD COLUMN title TEXT")
-                elif col == 'content':
-                    cursor.execute("ALTER TABLE notes ADD COLUMN content TEXT")
-                elif col == 'file_type':
-                    cursor.execute("ALTER TABLE notes ADD COLUMN file_type TEXT")
-                elif col == 'updated_at':
-                    cursor.execute("ALTER TABLE notes ADD COLUMN updated_at TIMESTAMP")
-                    # SQLite limitation: set current timestamp for existing rows
-                    cursor.execute("UPDATE notes SET updated_at = datetime('now') WHERE updated_at IS NULL")
-        
-        # Update metrics_history table
-        cursor.execute("PRAGMA table_info(metrics_history)")
-        metrics_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'course_id' not in metrics_columns:
-            print("Adding course_id to metrics_history table...")
-            cursor.execute("ALTER TABLE metrics_history ADD COLUMN course_id INTEGER")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_history_course_id ON metrics_history(course_id)")
-        
-        # Create indexes if they don't exist
-        indexes_to_create = [
-            ("idx_students_user_id", "students(user_id)"),
-            ("idx_teachers_user_id", "teachers(user_id)"),
-            ("idx_student_courses_student_id", "student_courses(student_id)"),
-            ("idx_student_courses_course_id", "student_courses(course_id)"),
-            ("idx_notes_student_id", "notes(student_id)"),
-            ("idx_notes_course_id", "notes(course_id)"),
-            ("idx_metrics_history_student_id", "metrics_history(student_id)"),
-            ("idx_metrics_history_timestamp", "metrics_history(timestamp)")
-        ]
-        
-        for index_name, index_def in indexes_to_create:
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='index' AND name='{index_name}'")
-            if not cursor.fetchone():
-                print(f"Creating index: {index_name}")
-                cursor.execute(f"CREATE INDEX {index_name} ON {index_def}")
-        
-        conn.commit()
         print("Database migration completed successfully!")
         
     except Exception as e:
         print(f"Migration error: {e}")
         conn.rollback()
+        raise
     finally:
+        if leased:
+            conn.execute("DELETE FROM service_leases WHERE name = ? AND owner = ?", (MIGRATION_LEASE, owner))
+            conn.commit()
         conn.close()
 
+def init_database():
+    """
+    Initialize database with required tables. A database that is already at
+    the latest schema version costs a single query; otherwise the pending
+    migrations are applied and empty tables get the sample data. If a
+    migration fails the error is raised and nothing is seeded.
+    """
+    conn = get_db_connection()
+    try:
+        if get_schema_version(conn) >= LATEST_SCHEMA_VERSION:
+            return
+    finally:
+        conn.close()
+    
+    migrate_database()
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        seed_sample_data(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+    print("Database initialized successfully!")
+
 if __name__ == "__main__":
     init_database()
-    migrate_database()
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import logging
+import multiprocessing
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Optional
+
+from database import get_db
+from text_store import store_note_text, get_course_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+
+def _mark_running(job_id: str):
+    with get_db() as conn:
+        conn.execute("UPDATE extraction_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                     (job_id,))
+        conn.commit()
+
+
+def _mark_completed(job_id: str, text_length: int, page_count: Optional[int] = None):
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE extraction_jobs
+            SET status = 'completed', text_length = ?, page_count = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (text_length, page_count, job_id))
+        conn.commit()
+
+
+def run_note_job(job_id: str, note_id: int, file_path: str) -> int:
+    """Extract a note into note_texts. Entry point for extraction workers."""
+    _mark_running(job_id)
+    text = store_note_text(note_id, file_path)
+    _mark_completed(job_id, len(text))
+    return len(text)
+
+
+def run_course_pdf_job(job_id: str, pdf_path: str) -> int:
+    """Extract every page of a course PDF into the page cache. Entry point for extraction workers."""
+    _mark_running(job_id)
+    texts, page_count = get_course_pdf_pages(pdf_path)
+    text_length = sum(len(text) for text in texts.values())
+    _mark_completed(job_id, text_length, page_count)
+    return text_length
+
+
+class ExtractionService:
+    """
+    Runs PDF/TXT text extraction in worker processes so parsing never blocks the event loop.
+
+    Uploads submit a job and get its id back immediately. The job writes the
+    text into the note/course text store and its status is kept in
+    extraction_jobs, so any server worker can report it. Requests that need
+    the text in their response await run() instead. With workers=0
+    extraction runs in a thread of the current process. Jobs still pending
+    or running job_timeout_seconds after they were queued are presumed lost
+    (for example to a restart) and no longer reported as active.
+    """
+    def __init__(self, workers: int = 2, job_timeout_seconds: int = 300):
+        self.workers = workers
+        self.job_timeout_seconds = job_timeout_seconds
+
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                # Spawn rather than fork so workers don't inherit the server's threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction")
+        return self._executor
+
+    def start(self):
+        """Start the worker processes"""
+        if self._executor is None:
+            self.executor
+            logger.info(f"Extraction service started with {self.workers} worker processes")
+
+    def shutdown(self):
+        """Stop the workers, dropping jobs that have not started yet"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _replace_executor(self, executor: Executor):
+        """Replace a pool whose worker process died"""
+        if executor is self._executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.warning("Restarted extraction workers")
+
+    async def run(self, function, *args):
+        """Run an extraction function in a worker and return its result"""
+        executor = self.executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            self._replace_executor(executor)
+            raise
+
+    def _submit(self, kind: str, target_id: int, function, *args) -> str:
+        executor = self.executor
+        job_id = uuid.uuid4().hex
+        with get_db() as conn:
+            conn.execute("INSERT INTO extraction_jobs (id, kind, target_id) VALUES (?, ?, ?)",
+                         (job_id, kind, target_id))
+            conn.commit()
+        try:
+            future = executor.submit(function, job_id, *args)
+        except Exception as e:
+            # The job will never run, so it must not be reported as pending
+            if isinstance(e, BrokenProcessPool):
+                self._replace_executor(executor)
+            self._mark_failed(job_id, str(e) or type(e).__name__)
+            raise
+        future.add_done_callback(partial(self._job_done, job_id, executor))
+        return job_id
+
+    def _job_done(self, job_id: str, executor: Executor, future: Future):
+        """Record jobs that failed or never ran; completed jobs record themselves"""
+        if future.cancelled():
+            error = "Cancelled at shutdown"
+        else:
+            exception = future.exception()
+            if exception is None:
+                return
+            if isinstance(exception, BrokenProcessPool):
+                self._replace_executor(executor)
+            error = str(exception) or type(exception).__name__
+        self._mark_failed(job_id, error)
+
+    def _mark_failed(self, job_id: str, error: str):
+        logger.error(f"Extraction job {job_id} failed: {error}")
+        try:
+            with get_db() as conn:
+                conn.execute("""
+                    UPDATE extraction_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (error, job_id))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording failed extraction job {job_id}: {e}")
+
+    def submit_note(self, note_id: int, file_path: str) -> str:
+        """Queue the extraction of an uploaded note, returning the job id"""
+        return self._submit("note", note_id, run_note_job, note_id, file_path)
+
+    def submit_course_pdf(self, course_id: int, pdf_path: str) -> str:
+        """Queue the extraction of a course PDF into the page cache, returning the job id"""
+        return self._submit("course_pdf", course_id, run_course_pdf_job, pdf_path)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Status of a job, or None if there is no such job"""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM extraction_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def get_active_job(self, kind: str, target_id: int) -> Optional[dict]:
+        """Latest pending or running job for a note or course, or None"""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM extraction_jobs
+                WHERE kind = ? AND target_id = ? AND status IN ('pending', 'running')
+                  AND created_at > datetime('now', ?)
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (kind, target_id, f"-{self.job_timeout_seconds} seconds"))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+
+# Global extraction service, started from the FastAPI lifespan
+extraction_service = ExtractionService(
+    workers=int(os.getenv("EXTRACTION_WORKERS", "2")),
+    job_timeout_seconds=int(os.getenv("EXTRACTION_JOB_TIMEOUT", "300"))
+)
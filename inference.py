@@ -0,0 +1,142 @@
+import asyncio
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Dict, List, Optional, Union
+
+from utils import run_analysis_job, run_analysis_batch_job, warm_up_analysis
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBusyError(Exception):
+    """Raised when the inference service cannot accept another frame"""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class InferenceService:
+    """
+    Runs FaceMesh analysis in worker processes so frames never block the event loop.
+
+    Each worker is a single-process pool with its own tracker pool, and a
+    student is always routed to the same worker so their smoothing state
+    stays in one place. The number of frames in flight is bounded: a student
+    with too many pending frames gets a 429, and a full queue gets a 503.
+    With workers=0 frames are analyzed in a thread of the current process.
+    """
+    def __init__(self, workers: int = 2, max_pending_per_worker: int = 8,
+                 max_pending_per_student: int = 2):
+        self.workers = workers
+        self.max_pending = max(1, workers) * max_pending_per_worker
+        self.max_pending_per_student = max_pending_per_student
+
+        self._executors: List[ProcessPoolExecutor] = []
+        self._pending = 0
+        self._pending_by_student: Dict[Optional[int], int] = {}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Start the worker processes"""
+        if self._executors or self.workers <= 0:
+            return
+
+        # Spawn rather than fork so workers don't inherit the server's threads
+        context = multiprocessing.get_context("spawn")
+        self._executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context)
+            for _ in range(self.workers)
+        ]
+        logger.info(f"Inference service started with {self.workers} worker processes")
+
+    def warm_up(self):
+        """
+        Load OpenCV, MediaPipe and a FaceMesh graph in every worker ahead of the
+        first frame. Runs in the background; frames sent meanwhile just wait.
+        """
+        if self._executors:
+            for executor in self._executors:
+                executor.submit(warm_up_analysis)
+        elif self.workers <= 0:
+            threading.Thread(target=warm_up_analysis, name="inference-warm-up", daemon=True).start()
+
+    def shutdown(self):
+        """Stop the worker processes, dropping frames that have not started yet"""
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = []
+
+    def _executor_for(self, student_id: Optional[int]) -> Optional[ProcessPoolExecutor]:
+        """Pick the worker that owns this student's tracker"""
+        if not self._executors:
+            return None
+        return self._executors[(student_id or 0) % len(self._executors)]
+
+    def _replace_executor(self, executor: ProcessPoolExecutor):
+        """Replace a worker whose process died"""
+        if executor not in self._executors:
+            return
+        index = self._executors.index(executor)
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executors[index] = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        logger.warning(f"Restarted inference worker {index}")
+
+    async def analyze(self, image_data: Union[str, bytes], student_cognitive_limit: int = 50,
+                      student_id: Optional[int] = None, **job_options) -> dict:
+        """
+        Analyze a frame in the student's worker and return the metrics dict.
+        job_options (debug, overlay_mode, ...) are passed on to run_analysis_job.
+        """
+        job = partial(run_analysis_job, image_data, student_cognitive_limit, student_id, **job_options)
+        return await self._run(student_id, 1, job)
+
+    async def analyze_batch(self, images: List[Union[str, bytes]], student_cognitive_limit: int = 50,
+                            student_id: Optional[int] = None) -> List[dict]:
+        """
+        Analyze several frames of one student in order in their worker.
+        The batch takes one of the student's in-flight slots and one queue slot per frame.
+        """
+        job = partial(run_analysis_batch_job, images, student_cognitive_limit, student_id)
+        return await self._run(student_id, len(images), job)
+
+    async def _run(self, student_id: Optional[int], frames: int, job):
+        """Run a job in the student's worker, enforcing the in-flight limits"""
+        # A batch larger than the whole queue is still admitted when the queue is empty
+        if self._pending and self._pending + frames > self.max_pending:
+            raise InferenceBusyError(503, "Analysis queue is full, please retry shortly")
+        if self._pending_by_student.get(student_id, 0) >= self.max_pending_per_student:
+            raise InferenceBusyError(429, "Too many frames in flight for this student")
+
+        self._pending += frames
+        self._pending_by_student[student_id] = self._pending_by_student.get(student_id, 0) + 1
+        try:
+            executor = self._executor_for(student_id)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(executor, job)
+            except BrokenProcessPool:
+                self._replace_executor(executor)
+                raise InferenceBusyError(503, "Analysis worker restarted, please retry")
+        finally:
+            self._pending -= frames
+            self._pending_by_student[student_id] -= 1
+            if not self._pending_by_student[student_id]:
+                del self._pending_by_student[student_id]
+
+
+# Global inference service, started from the FastAPI lifespan
+inference_service = InferenceService(
+    workers=int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    max_pending_per_worker=int(os.getenv("INFERENCE_QUEUE_PER_WORKER", "8")),
+    max_pending_per_student=int(os.getenv("INFERENCE_QUEUE_PER_STUDENT", "2"))
+)
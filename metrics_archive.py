@@ -0,0 +1,281 @@
+import asyncio
+import os
+import logging
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import numpy as np
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# service_leases row held by the process that is archiving
+LEASE_NAME = "metrics_archive"
+
+# metrics_history columns stored in the archives, with their array types.
+# Missing course ids are stored as -1 and missing durations as NaN.
+ARCHIVE_COLUMNS = {
+    "id": np.int64,
+    "course_id": np.int64,
+    "timestamp": np.int64,  # Seconds since the epoch (UTC)
+    "gaze_score": np.float64,
+    "face_attention": np.float64,
+    "cognitive_load": np.float64,
+    "emotional_state": np.str_,
+    "progress": np.float64,
+    "session_duration": np.float64
+}
+
+
+def _to_epoch(timestamp: str) -> int:
+    return int(datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp())
+
+
+def _from_epoch(epoch: int) -> str:
+    return datetime.fromtimestamp(int(epoch), timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _next_month(month: datetime) -> datetime:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+class MetricsArchiver:
+    """
+    Retention job for raw metrics_history rows.
+
+    Rows older than retention_days are moved into compressed columnar NumPy
+    archives with one file per student and month
+    (<archive_dir>/student_<id>/<YYYY-MM>.npz). The time-bucketed rollups
+    stay in SQLite, so long-range charts are unaffected. A run rewrites
+    each month file once: the month's old rows are merged into it, the
+    result is synced to a temporary file and renamed over the archive, and
+    only then are the rows deleted, chunk_size per transaction. Rows are
+    de-duplicated by id when merged, so an interrupted run only repeats
+    work. A lease in service_leases keeps archival to one server process
+    at a time. read() serves archived ranges on demand. Archival is
+    opt-in: with retention_days=0 (the default) every row stays in SQLite.
+    """
+    def __init__(self, archive_dir: str = "archives/metrics", retention_days: int = 0,
+                 chunk_size: int = 5000, interval_seconds: float = 3600, lease_seconds: float = 600):
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds
+
+        self._task: Optional[asyncio.Task] = None
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @property
+    def cutoff(self) -> datetime:
+        """Rows older than this (naive UTC) are archived"""
+        return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=self.retention_days)
+
+    def start(self):
+        """Start the periodic archival task on the running event loop"""
+        if self._task is not None or self.retention_days <= 0:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Metrics archiver started (retention {self.retention_days} days)")
+
+    async def stop(self):
+        """Cancel the archival task, letting a running month finish"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await asyncio.to_thread(self.archive_old_metrics)
+                if archived:
+                    logger.info(f"Archived {archived} metrics_history rows")
+            except Exception as e:
+                logger.error(f"Error archiving metrics: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def _path(self, student_id: int, month: str) -> str:
+        return os.path.join(self.archive_dir, f"student_{student_id}", f"{month}.npz")
+
+    def _acquire_lease(self) -> bool:
+        """Take or renew the archival lease, False while another process holds it"""
+        with get_db() as conn:
+            cursor = conn.execute("""
+                INSERT INTO service_leases (name, owner, expires_at)
+                VALUES (?, ?, datetime('now', ?))
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE service_leases.owner = excluded.owner OR service_leases.expires_at < datetime('now')
+            """, (LEASE_NAME, self._owner, f"+{int(self.lease_seconds)} seconds"))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def _release_lease(self):
+        with get_db() as conn:
+            conn.execute("DELETE FROM service_leases WHERE name = ? AND owner = ?", (LEASE_NAME, self._owner))
+            conn.commit()
+
+    def archive_old_metrics(self) -> int:
+        """
+        Move every row older than the cutoff into the archives, returning the
+        number moved. Does nothing while another process holds the lease.
+        """
+        if not self._acquire_lease():
+            return 0
+        try:
+            cutoff = self.cutoff
+            total = 0
+            for student_id, month in self._pending_months(cutoff):
+                total += self._archive_month(student_id, month, cutoff)
+                # Renew the lease; if it lapsed and another process took it, leave the rest to that one
+                if not self._acquire_lease():
+                    logger.warning("Metrics archive lease lost, stopping this run")
+                    break
+            return total
+        finally:
+            self._release_lease()
+
+    def _pending_months(self, cutoff: datetime) -> List[tuple]:
+        """(student_id, first day of month) of every month that may hold rows older than the cutoff"""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT student_id, MIN(timestamp) AS oldest
+                FROM metrics_history
+                WHERE timestamp < ?
+                GROUP BY student_id
+            """, (cutoff.strftime(TIMESTAMP_FORMAT),))
+            oldest = cursor.fetchall()
+
+        months = []
+        for row in oldest:
+            month = datetime.fromisoformat(row["oldest"]).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            while month < cutoff:
+                months.append((row["student_id"], month))
+                month = _next_month(month)
+        return months
+
+    def _archive_month(self, student_id: int, month: datetime, cutoff: datetime) -> int:
+        """Move a student's rows of one month that are older than the cutoff"""
+        end = min(_next_month(month), cutoff)
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, course_id, timestamp, gaze_score, face_attention,
+                       cognitive_load, emotional_state, progress, session_duration
+                FROM metrics_history
+                WHERE student_id = ? AND timestamp >= ? AND timestamp < ?
+            """, (student_id, month.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT)))
+            rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        # The archive is on disk before any of its rows leave SQLite
+        self._append(student_id, month.strftime("%Y-%m"), rows)
+
+        ids = [row["id"] for row in rows]
+        with get_db() as conn:
+            for offset in range(0, len(ids), self.chunk_size):
+                chunk = ids[offset:offset + self.chunk_size]
+                conn.execute(f"DELETE FROM metrics_history WHERE id IN ({', '.join('?' for _ in chunk)})", chunk)
+                conn.commit()
+        return len(rows)
+
+    def _append(self, student_id: int, month: str, rows: List):
+        """Merge rows into a student's month archive, replacing the file atomically"""
+        columns = {
+            "id": [row["id"] for row in rows],
+            "course_id": [row["course_id"] if row["course_id"] is not None else -1 for row in rows],
+            "timestamp": [_to_epoch(row["timestamp"]) for row in rows],
+            "session_duration": [row["session_duration"] if row["session_duration"] is not None else np.nan
+                                 for row in rows]
+        }
+        for name in ("gaze_score", "face_attention", "cognitive_load", "emotional_state", "progress"):
+            columns[name] = [row[name] for row in rows]
+        arrays = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in ARCHIVE_COLUMNS.items()}
+
+        path = self._path(student_id, month)
+        if os.path.exists(path):
+            with np.load(path) as existing:
+                arrays = {name: np.concatenate([existing[name], arrays[name]]) for name in ARCHIVE_COLUMNS}
+            # Rows from an interrupted run may already be in the file
+            _, unique = np.unique(arrays["id"], return_index=True)
+            if len(unique) < len(arrays["id"]):
+                arrays = {name: values[unique] for name, values in arrays.items()}
+        order = np.argsort(arrays["timestamp"], kind="stable")
+        arrays = {name: values[order] for name, values in arrays.items()}
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez_compressed(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        # Make the rename itself durable (directories can't be opened for syncing on Windows)
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def read(self, student_id: int, start: datetime, end: datetime,
+             course_id: Optional[int] = None) -> List[dict]:
+        """Archived rows of a student with start <= timestamp < end (naive UTC), oldest first"""
+        start_epoch = int(start.replace(tzinfo=timezone.utc).timestamp())
+        end_epoch = int(end.replace(tzinfo=timezone.utc).timestamp())
+
+        # Month files overlapping the range
+        months = []
+        month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while month < end:
+            months.append(month.strftime("%Y-%m"))
+            month = _next_month(month)
+
+        # Archives are replaced by renames, so a reader sees either the old or the new file
+        rows = []
+        for month in months:
+            path = self._path(student_id, month)
+            if not os.path.exists(path):
+                continue
+            with np.load(path) as archive:
+                arrays = {name: archive[name] for name in ARCHIVE_COLUMNS}
+            mask = (arrays["timestamp"] >= start_epoch) & (arrays["timestamp"] < end_epoch)
+            if course_id:
+                mask &= arrays["course_id"] == course_id
+            for index in np.flatnonzero(mask):
+                session_duration = float(arrays["session_duration"][index])
+                rows.append({
+                    "id": int(arrays["id"][index]),
+                    "student_id": student_id,
+                    "course_id": int(arrays["course_id"][index]) if arrays["course_id"][index] >= 0 else None,
+                    "timestamp": _from_epoch(arrays["timestamp"][index]),
+                    "gaze_score": float(arrays["gaze_score"][index]),
+                    "face_attention": float(arrays["face_attention"][index]),
+                    "cognitive_load": float(arrays["cognitive_load"][index]),
+                    "emotional_state": str(arrays["emotional_state"][index]),
+                    "progress": float(arrays["progress"][index]),
+                    "session_duration": None if np.isnan(session_duration) else session_duration
+                })
+        return rows
+
+
+# Global metrics archiver, started from the FastAPI lifespan.
+# Set METRICS_RETENTION_DAYS to a number of days to enable archival.
+metrics_archiver = MetricsArchiver(
+    archive_dir=os.getenv("METRICS_ARCHIVE_DIR", os.path.join("archives", "metrics")),
+    retention_days=int(os.getenv("METRICS_RETENTION_DAYS", "0")),
+    chunk_size=int(os.getenv("METRICS_ARCHIVE_CHUNK_SIZE", "5000")),
+    interval_seconds=float(os.getenv("METRICS_ARCHIVE_INTERVAL", "3600"))
+)
@@ -0,0 +1,326 @@
+import os
+import math
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from database import get_db, BUCKET_RESOLUTIONS, BUCKET_METRICS
+from utils import calculate_engagement
+
+logger = logging.getLogger(__name__)
+
+METRICS_INSERT_SQL = """
+    INSERT INTO metrics_history
+    (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+     emotional_state, progress, session_duration)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def check_metrics_row(row: Tuple):
+    """Raise ValueError unless a row (in METRICS_INSERT_SQL order) has the types the aggregates expect"""
+    (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+     emotional_state, progress, session_duration) = row
+    for name, value in (("gaze_score", gaze_score), ("face_attention", face_attention),
+                        ("cognitive_load", cognitive_load), ("progress", progress)):
+        if not is_number(value):
+            raise ValueError(f"{name} must be a finite number, got {value!r}")
+    if session_duration is not None and not is_number(session_duration):
+        raise ValueError(f"session_duration must be a finite number, got {session_duration!r}")
+    if not isinstance(emotional_state, str):
+        raise ValueError(f"emotional_state must be a string, got {emotional_state!r}")
+
+
+def metrics_row(student_id: int, course_id: Optional[int], gaze_score: float,
+                face_attention: float, cognitive_load: float, emotional_state: str,
+                progress: float = 0.0, session_duration: Optional[float] = 2.0) -> Tuple:
+    """
+    Parameters for METRICS_INSERT_SQL, timestamped now like CURRENT_TIMESTAMP.
+    Raises ValueError for values that can't be stored (see check_metrics_row).
+    """
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    row = (student_id, course_id, timestamp, gaze_score, face_attention,
+           cognitive_load, emotional_state, progress, session_duration)
+    check_metrics_row(row)
+    return row
+
+
+# Folds a batch of rows for one (student, course) into its running aggregates.
+# Only enrollments are updated: metrics for a current course the student is not
+# enrolled in stay in metrics_history and the buckets but create no enrollment.
+COURSE_ROLLUP_SQL = """
+    UPDATE student_courses SET
+        metrics_count = COALESCE(metrics_count, 0) + :count,
+        cognitive_load_sum = COALESCE(cognitive_load_sum, 0.0) + :cognitive_load_sum,
+        cognitive_load_sumsq = COALESCE(cognitive_load_sumsq, 0.0) + :cognitive_load_sumsq,
+        cognitive_load_min = MIN(COALESCE(cognitive_load_min, :cognitive_load_min), :cognitive_load_min),
+        cognitive_load_max = MAX(COALESCE(cognitive_load_max, :cognitive_load_max), :cognitive_load_max),
+        engagement_sum = COALESCE(engagement_sum, 0.0) + :engagement_sum,
+        engagement_sumsq = COALESCE(engagement_sumsq, 0.0) + :engagement_sumsq,
+        engagement_min = MIN(COALESCE(engagement_min, :engagement_min), :engagement_min),
+        engagement_max = MAX(COALESCE(engagement_max, :engagement_max), :engagement_max),
+        session_seconds = COALESCE(session_seconds, 0.0) + :session_seconds,
+        avg_cognitive_load = (COALESCE(cognitive_load_sum, 0.0) + :cognitive_load_sum)
+                             / (COALESCE(metrics_count, 0) + :count),
+        avg_engagement = (COALESCE(engagement_sum, 0.0) + :engagement_sum)
+                         / (COALESCE(metrics_count, 0) + :count),
+        time_spent_minutes = MAX(COALESCE(time_spent_minutes, 0),
+                                 CAST((COALESCE(session_seconds, 0.0) + :session_seconds) / 60 AS INTEGER))
+    WHERE student_id = :student_id AND course_id = :course_id
+"""
+
+
+def apply_course_rollups(conn, rows: List[Tuple]):
+    """Add metrics_history rows (in METRICS_INSERT_SQL order) to the student_courses rollups"""
+    rollups = {}
+    for row in rows:
+        check_metrics_row(row)
+        student_id, course_id, _, _, face_attention, cognitive_load, _, _, session_duration = row
+        if course_id is None:
+            continue
+        engagement = calculate_engagement(face_attention)
+        rollup = rollups.get((student_id, course_id))
+        if rollup is None:
+            rollup = rollups[(student_id, course_id)] = {
+                "student_id": student_id, "course_id": course_id, "count": 0,
+                "cognitive_load_sum": 0.0, "cognitive_load_sumsq": 0.0,
+                "cognitive_load_min": cognitive_load, "cognitive_load_max": cognitive_load,
+                "engagement_sum": 0.0, "engagement_sumsq": 0.0,
+                "engagement_min": engagement, "engagement_max": engagement,
+                "session_seconds": 0.0
+            }
+        rollup["count"] += 1
+        rollup["cognitive_load_sum"] += cognitive_load
+        rollup["cognitive_load_sumsq"] += cognitive_load * cognitive_load
+        rollup["cognitive_load_min"] = min(rollup["cognitive_load_min"], cognitive_load)
+        rollup["cognitive_load_max"] = max(rollup["cognitive_load_max"], cognitive_load)
+        rollup["engagement_sum"] += engagement
+        rollup["engagement_sumsq"] += engagement * engagement
+        rollup["engagement_min"] = min(rollup["engagement_min"], engagement)
+        rollup["engagement_max"] = max(rollup["engagement_max"], engagement)
+        rollup["session_seconds"] += session_duration or 0.0
+    
+    if rollups:
+        conn.executemany(COURSE_ROLLUP_SQL, list(rollups.values()))
+
+
+# Merges a batch of rows into one bucket of one resolution
+METRIC_BUCKET_SQL = f"""
+    INSERT INTO metrics_buckets VALUES (
+        :resolution, :student_id, :course_id, :bucket_start, :count,
+        {", ".join(f":{metric}_sum, :{metric}_min, :{metric}_max" for metric in BUCKET_METRICS)},
+        :session_seconds
+    )
+    ON CONFLICT (resolution, student_id, course_id, bucket_start) DO UPDATE SET
+        sample_count = sample_count + excluded.sample_count,
+        {", ".join(
+            f"{metric}_sum = {metric}_sum + excluded.{metric}_sum, "
+            f"{metric}_min = MIN({metric}_min, excluded.{metric}_min), "
+            f"{metric}_max = MAX({metric}_max, excluded.{metric}_max)"
+            for metric in BUCKET_METRICS
+        )},
+        session_seconds = session_seconds + excluded.session_seconds
+"""
+
+METRIC_BUCKET_STATE_SQL = """
+    INSERT INTO metrics_bucket_states VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, student_id, course_id, bucket_start, emotional_state) DO UPDATE SET
+        sample_count = sample_count + excluded.sample_count
+"""
+
+
+def apply_metric_buckets(conn, rows: List[Tuple]):
+    """Add metrics_history rows (in METRICS_INSERT_SQL order) to the 1m/15m/1d buckets"""
+    buckets = {}
+    states = {}
+    for row in rows:
+        check_metrics_row(row)
+        (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+         emotional_state, _, session_duration) = row
+        epoch = int(datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+                    .replace(tzinfo=timezone.utc).timestamp())
+        values = {"gaze_score": gaze_score, "face_attention": face_attention, "cognitive_load": cognitive_load}
+        for resolution, seconds in BUCKET_RESOLUTIONS.items():
+            bucket_start = datetime.fromtimestamp(epoch // seconds * seconds, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            key = (resolution, student_id, course_id or 0, bucket_start)
+            
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {
+                    "resolution": resolution, "student_id": student_id,
+                    "course_id": course_id or 0, "bucket_start": bucket_start,
+                    "count": 0, "session_seconds": 0.0
+                }
+                for metric in BUCKET_METRICS:
+                    bucket[f"{metric}_sum"] = 0.0
+                    bucket[f"{metric}_min"] = bucket[f"{metric}_max"] = values[metric]
+            bucket["count"] += 1
+            bucket["session_seconds"] += session_duration or 0.0
+            for metric in BUCKET_METRICS:
+                value = values[metric]
+                bucket[f"{metric}_sum"] += value
+                bucket[f"{metric}_min"] = min(bucket[f"{metric}_min"], value)
+                bucket[f"{metric}_max"] = max(bucket[f"{metric}_max"], value)
+            
+            state_key = key + (emotional_state,)
+            states[state_key] = states.get(state_key, 0) + 1
+    
+    if buckets:
+        conn.executemany(METRIC_BUCKET_SQL, list(buckets.values()))
+        conn.executemany(METRIC_BUCKET_STATE_SQL, [key + (count,) for key, count in states.items()])
+
+
+def apply_metrics_aggregates(conn, rows: List[Tuple]):
+    """Keep every aggregate of metrics_history in step with newly inserted rows"""
+    apply_course_rollups(conn, rows)
+    apply_metric_buckets(conn, rows)
+
+
+class MetricsWriter:
+    """
+    Write-behind buffer for metrics_history rows.
+
+    Endpoints append rows in memory and a background thread inserts them in
+    one transaction once batch_size rows are pending or flush_interval_ms has
+    passed, so a classroom of webcams costs one commit per batch instead of
+    one per frame. Rows carry the time they were captured, not the time they
+    were flushed. The same transaction folds the rows into the per-course
+    aggregates and the time buckets (see apply_metrics_aggregates). When
+    the database is locked or unavailable the rows are kept for the next
+    flush, up to max_pending rows. When a batch fails on its data, its rows
+    are retried one by one and the rows that still fail are logged and
+    dropped, so one bad row cannot hold back everyone else's metrics.
+    Before start() (and after stop()) rows are written straight through.
+    """
+    def __init__(self, batch_size: int = 200, flush_interval_ms: int = 500,
+                 max_pending: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+
+        self._rows: List[Tuple] = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics writer started (batch {self.batch_size}, every {self.flush_interval * 1000:.0f} ms)")
+
+    def stop(self):
+        """Stop the flush thread and write every pending row"""
+        if not self._running:
+            return
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def add(self, student_id: int, course_id: Optional[int], gaze_score: float,
+            face_attention: float, cognitive_load: float, emotional_state: str,
+            progress: float = 0.0, session_duration: Optional[float] = 2.0):
+        """Queue one metrics_history row, timestamped now"""
+        self._append([metrics_row(
+            student_id, course_id, gaze_score, face_attention,
+            cognitive_load, emotional_state, progress, session_duration
+        )])
+
+    def _append(self, rows: List[Tuple]):
+        with self._condition:
+            self._rows.extend(rows)
+            if self._running:
+                if len(self._rows) >= self.batch_size:
+                    self._condition.notify()
+                return
+        # Not started: write through
+        self.flush()
+
+    def flush(self) -> int:
+        """Insert every pending row in one transaction, returning the number written"""
+        with self._flush_lock:
+            with self._condition:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            try:
+                self._write(rows)
+            except sqlite3.OperationalError as e:
+                self._requeue(rows, e)
+                return 0
+            except Exception as e:
+                logger.error(f"Error flushing {len(rows)} metrics rows, retrying them one by one: {e}")
+                return self._write_each(rows)
+            return len(rows)
+
+    def _write(self, rows: List[Tuple]):
+        """Insert rows and update the aggregates in one transaction"""
+        with get_db() as conn:
+            try:
+                conn.executemany(METRICS_INSERT_SQL, rows)
+                apply_metrics_aggregates(conn, rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _write_each(self, rows: List[Tuple]) -> int:
+        """Insert rows one transaction each, dropping the rows whose data is rejected"""
+        written = 0
+        for index, row in enumerate(rows):
+            try:
+                self._write([row])
+            except sqlite3.OperationalError as e:
+                self._requeue(rows[index:], e)
+                break
+            except Exception as e:
+                logger.error(f"Dropping invalid metrics row for student {row[0]}: {e} ({row!r})")
+                continue
+            written += 1
+        return written
+
+    def _requeue(self, rows: List[Tuple], error: Exception):
+        """Keep rows the database could not take for the next flush, within the cap"""
+        with self._condition:
+            # Put the rows back in front of newer ones
+            self._rows[:0] = rows
+            dropped = len(self._rows) - self.max_pending
+            if dropped > 0:
+                del self._rows[:dropped]
+        logger.error(f"Error flushing {len(rows)} metrics rows: {error}"
+                     + (f" ({dropped} oldest rows dropped)" if dropped > 0 else ""))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and len(self._rows) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if not self._running:
+                    return
+            self.flush()
+
+
+# Global metrics writer, started and flushed from the FastAPI lifespan
+metrics_writer = MetricsWriter(
+    batch_size=int(os.getenv("METRICS_BATCH_SIZE", "200")),
+    flush_interval_ms=int(os.getenv("METRICS_FLUSH_INTERVAL_MS", "500")),
+    max_pending=int(os.getenv("METRICS_MAX_PENDING", "10000"))
+)
@@ -69,6 +69,15 @@ class ProgressUpdate(BaseModel):
     face_attention_score: float  # 0 to 1
     course_id: Optional[int] = None  # Optional course ID for specific course updates
 
+# Metrics sample posted by the client
+class MetricsData(BaseModel):
+    gaze_score: float = 0.0
+    face_attention: float = 0.0
+    cognitive_load: float = 0.0
+    emotional_state: str = "neutral"
+    progress: float = 0.0
+    session_duration: Optional[float] = 2.0
+
 # Progress Response
 class ProgressResponse(BaseModel):
     new_progress: float
@@ -85,11 +94,38 @@ class ChatbotResponse(BaseModel):
     response: str
     type: str  # summarize, explain, key_points
 
+class ChatbotCacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+    entries: int
+    max_entries: int
+    ttl_seconds: int
+
+# Background text extraction job
+class ExtractionJob(BaseModel):
+    id: str
+    kind: str  # note or course_pdf
+    target_id: int  # note or course id
+    status: str  # pending, running, completed or failed
+    text_length: Optional[int] = None
+    page_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Image Analysis Request/Response
 class ImageAnalysisRequest(BaseModel):
     image_data: str  # Base64 encoded image
     student_id: int
 
+class DebugImageAnalysisRequest(ImageAnalysisRequest):
+    overlay_mode: str = "image"  # "image" renders a JPEG overlay, "data" returns bars/landmarks only
+    overlay_scale: float = 1.0  # Downscale factor for the overlay image, 0 to 1
+    overlay_quality: int = 95  # JPEG quality of the overlay image
+
 class ImageAnalysisResponse(BaseModel):
     gaze_score: float
     face_attention_score: float
@@ -98,6 +134,27 @@ class ImageAnalysisResponse(BaseModel):
     cognitive_load: float
     engagement_level: float
 
+class BatchFrame(BaseModel):
+    image_data: str  # Base64 encoded image
+    student_id: Optional[int] = None  # Defaults to the batch student_id
+
+class BatchImageAnalysisRequest(BaseModel):
+    frames: List[BatchFrame]  # In capture order
+    student_id: Optional[int] = None
+
+class BatchImageAnalysisResult(ImageAnalysisResponse):
+    student_id: int
+
+class BatchStudentError(BaseModel):
+    student_id: int
+    status_code: int  # 429/503 when the inference service was busy
+    detail: str
+    frames: List[int]  # Positions of the student's frames, which were not analyzed
+
+class BatchImageAnalysisResponse(BaseModel):
+    results: List[Optional[BatchImageAnalysisResult]]  # Same order as the request frames, None where analysis failed
+    errors: List[BatchStudentError] = []
+
 # Teacher Models
 class TeacherStudentInfo(BaseModel):
     id: int
@@ -139,6 +196,16 @@ class StudentAnalytics(BaseModel):
     average_engagement: float
     total_sessions: int
 
+class BulkStudentAnalytics(StudentAnalytics):
+    email: Optional[str] = None
+    progress: float
+
+class BulkStudentAnalyticsResponse(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    students: list[BulkStudentAnalytics]
+
 # Authentication Models
 class UserRegister(BaseModel):
     name: str
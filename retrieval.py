@@ -0,0 +1,206 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Page markers written by text_store.extract_labeled_pdf_text
+PAGE_MARKER = re.compile(r"^--- Page (\d+) ---$", re.MULTILINE)
+
+# Placed between the selected chunks in the prompt
+CHUNK_SEPARATOR = "\n\n...\n\n"
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i in is it its
+me my of on or so that the their then there these this to was were what when
+where which who why will with you your
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words without stopwords, as indexed and queried"""
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+def chunk_document(text: str, chunk_tokens: int = 200) -> List[str]:
+    """
+    Split a document into chunks of about chunk_tokens: pages first (keeping
+    their "Page N" label), then paragraphs, merging short paragraphs and
+    splitting long ones on word boundaries.
+    """
+    # (label, text) per page; text before the first marker has no label
+    parts = PAGE_MARKER.split(text)
+    pages = [("", parts[0])] + [(f"[Page {parts[i]}]", parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+    chunks = []
+    for label, page in pages:
+        current = []
+        current_tokens = 0
+
+        def flush():
+            nonlocal current, current_tokens
+            if current:
+                body = "\n\n".join(current)
+                chunks.append(f"{label}\n{body}" if label else body)
+            current, current_tokens = [], 0
+
+        for paragraph in re.split(r"\n\s*\n", page):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = estimate_tokens(paragraph)
+            if tokens > chunk_tokens:
+                # Long paragraph: its own chunks, cut into word windows
+                flush()
+                words = paragraph.split()
+                step = max(1, len(words) * chunk_tokens // tokens)
+                for start in range(0, len(words), step):
+                    current = [" ".join(words[start:start + step])]
+                    flush()
+                continue
+            if current_tokens + tokens > chunk_tokens:
+                flush()
+            current.append(paragraph)
+            current_tokens += tokens
+        flush()
+    return chunks
+
+
+class DocumentIndex:
+    """
+    BM25 index over the chunks of one document. Term frequencies are stored
+    as sparse postings (per term, the chunks it occurs in and how often), so
+    scoring a query touches only the postings of its terms.
+    """
+    def __init__(self, text: str, chunk_tokens: int = 200, k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunk_document(text, chunk_tokens)
+        self.k1 = k1
+        self.b = b
+
+        terms: dict = {}
+        term_ids = []
+        chunk_ids = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            words = tokenize(chunk)
+            term_ids.extend(terms.setdefault(word, len(terms)) for word in words)
+            chunk_ids.extend([chunk_id] * len(words))
+        self.terms = terms
+        self.lengths = np.bincount(np.asarray(chunk_ids, dtype=np.int64), minlength=len(self.chunks)).astype(np.float64)
+        self.avg_length = float(self.lengths.mean()) if len(self.chunks) else 0.0
+
+        # Postings sorted by term: (term, chunk) pairs with their counts
+        stride = max(1, len(self.chunks))
+        keys = np.asarray(term_ids, dtype=np.int64) * stride + np.asarray(chunk_ids, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        self.posting_chunks = keys % stride
+        self.posting_counts = counts.astype(np.float64)
+        self.term_starts = np.searchsorted(keys // stride, np.arange(len(terms) + 1))
+
+        # Inverse document frequency per term
+        doc_freq = np.diff(self.term_starts).astype(np.float64)
+        self.idf = np.log(1.0 + (len(self.chunks) - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for a query"""
+        scores = np.zeros(len(self.chunks))
+        if not self.chunks or not self.avg_length:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / self.avg_length)
+        for word in set(tokenize(query)):
+            term = self.terms.get(word)
+            if term is None:
+                continue
+            start, end = self.term_starts[term], self.term_starts[term + 1]
+            chunk_ids = self.posting_chunks[start:end]
+            tf = self.posting_counts[start:end]
+            scores[chunk_ids] += self.idf[term] * tf * (self.k1 + 1) / (tf + norm[chunk_ids])
+        return scores
+
+
+class ContextRetriever:
+    """
+    Picks the parts of the chatbot context that are relevant to a question.
+
+    Contexts that fit in token_budget are used whole. Larger ones are split
+    into page/paragraph chunks and ranked with BM25, and the top_k best
+    chunks that fit in the budget are kept, in document order. Indexes are
+    cached per document (by content hash), so follow-up questions about the
+    same notes or PDF skip the chunking and indexing.
+    """
+    def __init__(self, token_budget: int = 3000, top_k: int = 8, chunk_tokens: int = 200,
+                 cache_size: int = 32):
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.chunk_tokens = chunk_tokens
+        self.cache_size = cache_size
+
+        self._indexes: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self, text: str) -> DocumentIndex:
+        """Cached index of a document"""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is not None:
+                self._indexes[key] = index
+                return index
+
+        index = DocumentIndex(text, self.chunk_tokens)
+        logger.info(f"Indexed {len(index.chunks)} chunks ({len(index.terms)} terms) for chatbot context")
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def select(self, question: str, documents: List[str]) -> str:
+        """Context for the prompt: every document if they fit, the best chunks otherwise"""
+        documents = [document for document in documents if document.strip()]
+        if sum(estimate_tokens(document) for document in documents) <= self.token_budget:
+            return "\n\n".join(documents)
+
+        # (score, document, chunk) for every chunk of every document
+        candidates: List[Tuple[float, int, int]] = []
+        indexes = [self.index(document) for document in documents]
+        for doc_id, index in enumerate(indexes):
+            scores = index.score(question)
+            candidates.extend((float(score), doc_id, chunk_id) for chunk_id, score in enumerate(scores))
+
+        ranked = sorted(candidates, key=lambda candidate: (-candidate[0], candidate[1], candidate[2]))
+        if not ranked or ranked[0][0] <= 0:
+            # Nothing matches the question: keep the start of each document
+            ranked = sorted(candidates, key=lambda candidate: (candidate[2], candidate[1]))
+        else:
+            ranked = [candidate for candidate in ranked if candidate[0] > 0][:self.top_k]
+
+        selected = []
+        used = 0
+        for _, doc_id, chunk_id in ranked:
+            tokens = estimate_tokens(indexes[doc_id].chunks[chunk_id] + CHUNK_SEPARATOR)
+            if used + tokens > self.token_budget:
+                continue
+            selected.append((doc_id, chunk_id))
+            used += tokens
+
+        return CHUNK_SEPARATOR.join(indexes[doc_id].chunks[chunk_id] for doc_id, chunk_id in sorted(selected))
+
+
+# Global context retriever used by the chatbot endpoints
+context_retriever = ContextRetriever(
+    token_budget=int(os.getenv("CHATBOT_CONTEXT_TOKENS", "3000")),
+    top_k=int(os.getenv("CHATBOT_TOP_K", "8")),
+    chunk_tokens=int(os.getenv("CHATBOT_CHUNK_TOKENS", "200")),
+    cache_size=int(os.getenv("CHATBOT_INDEX_CACHE_SIZE", "32"))
+)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The app modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the services in-process and offline; set before the modules read them
+os.environ.setdefault("INFERENCE_WORKERS", "0")
+os.environ.setdefault("EXTRACTION_WORKERS", "0")
+os.environ.setdefault("WARM_UP_MODELS", "0")
+os.environ["GEMINI_API_KEY"] = ""
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A migrated and seeded database in a temporary working directory"""
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "study_app.db")
+    monkeypatch.setattr(database, "DATABASE_URL", path)
+    database.connection_pool.close_all()
+    database.init_database()
+    yield path
+    database.connection_pool.close_all()
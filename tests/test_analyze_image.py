@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Request
+from fastapi.testclient import TestClient
+
+import main
+
+BOUNDARY = "frame-boundary"
+
+
+def multipart_body(payload: bytes, field: str = "file") -> bytes:
+    return (f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="frame.jpg"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n").encode() + payload + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def chunked(body: bytes, size: int = 1024):
+    """Request content without a Content-Length, sent with chunked encoding"""
+    for offset in range(0, len(body), size):
+        yield body[offset:offset + size]
+
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    monkeypatch.setattr(main, "MAX_FRAME_BYTES", 4096)
+    monkeypatch.setattr(main, "MULTIPART_OVERHEAD_BYTES", 1024)
+    return TestClient(main.app)
+
+
+def test_raw_frame_over_limit_is_rejected(client):
+    response = client.post("/students/1/analyze_image", content=chunked(b"x" * 5000),
+                           headers={"Content-Type": "application/octet-stream"})
+    assert response.status_code == 413
+
+
+def test_chunked_multipart_over_limit_is_rejected(client):
+    # Called directly: the test client reads the whole request body before sending it
+    chunks = chunked(multipart_body(b"x" * 100_000))
+    received = []
+
+    async def receive():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        received.append(len(chunk))
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    scope = {"type": "http", "method": "POST", "path": "/students/1/analyze_image", "query_string": b"",
+             "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]}
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.analyze_image_bytes_endpoint(1, Request(scope, receive)))
+    assert error.value.status_code == 413
+    # Rejected once the cap was passed, not after buffering the whole form
+    assert sum(received) < 10_000
+
+
+def test_multipart_file_over_limit_is_rejected(client):
+    # Within the framing allowance, but the frame itself is too large
+    response = client.post("/students/1/analyze_image", content=chunked(multipart_body(b"x" * 4500)),
+                           headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert response.status_code == 413
+
+
+def test_chunked_multipart_within_limit_is_parsed(client):
+    response = client.post("/students/1/analyze_image", content=chunked(multipart_body(b"x" * 100, field="image")),
+                           headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+    assert response.status_code == 400
+    assert "'file' field" in response.json()["detail"]
@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import get_db
+
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    # Store a metrics row for every frame
+    monkeypatch.setattr(main, "STREAM_STORE_INTERVAL", 0)
+    return TestClient(main.app)
+
+
+def blank_frame() -> bytes:
+    return cv2.imencode(".jpg", np.zeros((120, 160, 3), dtype=np.uint8))[1].tobytes()
+
+
+def latest_course_id(student_id=1):
+    with get_db() as conn:
+        return conn.execute("SELECT course_id FROM metrics_history WHERE student_id = ? ORDER BY id DESC LIMIT 1",
+                            (student_id,)).fetchone()["course_id"]
+
+
+def set_current_course(course_id, student_id=1):
+    with get_db() as conn:
+        conn.execute("UPDATE students SET current_course_id = ? WHERE id = ?", (course_id, student_id))
+        conn.commit()
+
+
+def test_course_switch_applies_mid_session(client):
+    set_current_course(1)
+    with client.websocket_connect("/ws/analyze/1") as websocket:
+        websocket.send_bytes(blank_frame())
+        assert websocket.receive_json()["seq"] == 1
+        assert latest_course_id() == 1
+
+        set_current_course(2)
+        websocket.send_bytes(blank_frame())
+        assert websocket.receive_json()["seq"] == 2
+        assert latest_course_id() == 2
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from chat_client import ChatBackendError, ChatClient, LocalBackend
+
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def make(reply=None, delay=0.0, **kwargs):
+        client = ChatClient(LocalBackend(reply=reply, delay=delay), **kwargs)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.shutdown()
+
+
+async def collect(client, prompt):
+    return [text async for text in client.stream(prompt)]
+
+
+def test_generate(make_client):
+    client = make_client(reply=lambda prompt: f"echo: {prompt}")
+    assert asyncio.run(client.generate("hello")) == "echo: hello"
+    assert client.pending == 0
+
+
+def test_generate_times_out(make_client):
+    client = make_client(delay=0.5, timeout_seconds=0.05)
+    with pytest.raises(ChatBackendError, match="No response"):
+        asyncio.run(client.generate("hello"))
+    assert client.pending == 0
+
+
+def test_generate_wraps_backend_errors(make_client):
+    def fail(prompt):
+        raise RuntimeError("quota exceeded")
+
+    client = make_client(reply=fail)
+    with pytest.raises(ChatBackendError, match="quota exceeded"):
+        asyncio.run(client.generate("hello"))
+
+    client = make_client(reply=lambda prompt: "")
+    with pytest.raises(ChatBackendError, match="Empty response"):
+        asyncio.run(client.generate("hello"))
+
+
+def test_calls_beyond_max_pending_are_refused(make_client):
+    client = make_client(delay=0.2, max_concurrency=1, max_pending=1)
+
+    async def two_calls():
+        first = asyncio.ensure_future(client.generate("first"))
+        await asyncio.sleep(0)
+        with pytest.raises(ChatBackendError, match="Too many"):
+            await client.generate("second")
+        return await first
+
+    assert asyncio.run(two_calls()).startswith("Local assistant response")
+    assert client.pending == 0
+
+
+def test_stream_yields_the_reply_in_pieces(make_client):
+    client = make_client(reply=lambda prompt: "one two three")
+    pieces = asyncio.run(collect(client, "hello"))
+    assert len(pieces) == 3
+    assert "".join(pieces) == "one two three"
+    assert client.pending == 0
+
+
+def test_stream_times_out(make_client):
+    client = make_client(delay=0.5, timeout_seconds=0.05)
+    with pytest.raises(ChatBackendError, match="No response"):
+        asyncio.run(collect(client, "hello"))
+    assert client.pending == 0
+
+
+def test_stream_reports_backend_errors(make_client):
+    def fail(prompt):
+        raise RuntimeError("connection reset")
+
+    client = make_client(reply=fail)
+    with pytest.raises(ChatBackendError, match="connection reset"):
+        asyncio.run(collect(client, "hello"))
+
+    client = make_client(reply=lambda prompt: "")
+    with pytest.raises(ChatBackendError, match="Empty response"):
+        asyncio.run(collect(client, "hello"))
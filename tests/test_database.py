@@ -0,0 +1,84 @@
+import pytest
+
+import database
+from database import get_db
+
+
+@pytest.fixture
+def empty_db(tmp_path, monkeypatch):
+    """A database file that has not been migrated yet"""
+    monkeypatch.setattr(database, "DATABASE_URL", str(tmp_path / "study_app.db"))
+    database.connection_pool.close_all()
+    yield
+    database.connection_pool.close_all()
+
+
+def test_failed_migration_raises_and_skips_seeding(empty_db, monkeypatch):
+    def broken_migration(cursor):
+        cursor.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("migration failed")
+
+    broken_version = database.LATEST_SCHEMA_VERSION + 1
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS + [(broken_version, "broken", broken_migration)])
+    monkeypatch.setattr(database, "LATEST_SCHEMA_VERSION", broken_version)
+
+    with pytest.raises(RuntimeError):
+        database.init_database()
+
+    with get_db() as conn:
+        assert database.get_schema_version(conn) == broken_version - 1
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+        assert conn.execute("SELECT COUNT(*) FROM service_leases").fetchone()[0] == 0
+
+
+def test_migration_lease_is_exclusive_until_it_expires(db_path):
+    conn = database.get_db_connection()
+    try:
+        assert database.take_migration_lease(conn, "worker-1")
+        assert not database.take_migration_lease(conn, "worker-2")
+
+        conn.execute("UPDATE service_leases SET expires_at = datetime('now', '-1 seconds')")
+        conn.commit()
+        assert database.take_migration_lease(conn, "worker-2")
+    finally:
+        conn.close()
+
+
+def test_backfills_run_in_batches(db_path, monkeypatch):
+    monkeypatch.setattr(database, "MIGRATION_BATCH_STUDENTS", 1)
+    with get_db() as conn:
+        enrollments = conn.execute("SELECT student_id, course_id FROM student_courses").fetchall()
+        conn.executemany("""
+            INSERT INTO metrics_history
+            (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+             emotional_state, progress, session_duration)
+            VALUES (?, ?, '2026-01-01 10:00:00', 50, 60, 40, 'focused', 0, 2)
+        """, [(row["student_id"], row["course_id"]) for row in enrollments for _ in range(3)])
+        conn.execute("UPDATE student_courses SET metrics_count = 0")
+        conn.execute("DELETE FROM metrics_buckets")
+        conn.commit()
+    student_count = len({row["student_id"] for row in enrollments})
+    assert student_count > 1
+
+    batches = []
+    commit_batch = database.commit_migration_batch
+    monkeypatch.setattr(database, "commit_migration_batch", lambda cursor: batches.append(1) or commit_batch(cursor))
+
+    conn = database.get_db_connection()
+    try:
+        assert database.take_migration_lease(conn, "test")
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        database.add_course_rollups(cursor)
+        database.create_metrics_buckets(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert len(batches) == 2 * student_count
+    with get_db() as conn:
+        counts = {row[0] for row in conn.execute("SELECT metrics_count FROM student_courses").fetchall()}
+        assert counts == {3}
+        total = conn.execute("SELECT SUM(sample_count) FROM metrics_buckets WHERE resolution = '1d'").fetchone()[0]
+        assert total == 3 * len(enrollments)
@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import get_db
+from extraction import extraction_service
+
+
+class BrokenExecutor(ThreadPoolExecutor):
+    """Executor whose worker pool has died"""
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+
+@pytest.fixture
+def client(db_path):
+    yield TestClient(main.app)
+    extraction_service.shutdown()
+
+
+def test_failed_submit_is_not_reported_as_pending(client):
+    extraction_service._executor = BrokenExecutor(max_workers=1)
+
+    response = client.post("/students/1/upload_notes",
+                           files={"file": ("notes.txt", b"hello notes", "text/plain")})
+    assert response.status_code == 200
+    upload = response.json()
+    assert upload["job_id"] is None
+
+    with get_db() as conn:
+        jobs = conn.execute("SELECT status, error FROM extraction_jobs WHERE target_id = ?",
+                            (upload["note_id"],)).fetchall()
+    assert [job["status"] for job in jobs] == ["failed"]
+    assert "terminated abruptly" in jobs[0]["error"]
+    assert extraction_service.get_active_job("note", upload["note_id"]) is None
+
+    # The broken pool was replaced, so viewing the note extracts it inline
+    response = client.get(f"/students/1/notes/{upload['note_id']}/view")
+    assert response.status_code == 200
+    assert response.json() == {"content": "hello notes"}
+
+
+def test_view_reports_active_job(client):
+    response = client.post("/students/1/upload_notes",
+                           files={"file": ("notes.txt", b"hello notes", "text/plain")})
+    upload = response.json()
+    note_id = upload["note_id"]
+    for _ in range(100):
+        if extraction_service.get_job(upload["job_id"])["status"] == "completed":
+            break
+        time.sleep(0.05)
+
+    with get_db() as conn:
+        conn.execute("DELETE FROM note_texts WHERE note_id = ?", (note_id,))
+        conn.execute("INSERT INTO extraction_jobs (id, kind, target_id, status) VALUES ('queued', 'note', ?, 'pending')",
+                     (note_id,))
+        conn.commit()
+
+    response = client.get(f"/students/1/notes/{note_id}/view")
+    assert response.status_code == 202
+    assert response.json()["job_id"] == "queued"
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from database import get_db
+from metrics_archive import MetricsArchiver
+
+
+def insert_metrics(timestamps, student_id=1):
+    with get_db() as conn:
+        conn.executemany("""
+            INSERT INTO metrics_history
+            (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+             emotional_state, progress, session_duration)
+            VALUES (?, 1, ?, 50, 60, 40, 'focused', 10, 2)
+        """, [(student_id, timestamp) for timestamp in timestamps])
+        conn.commit()
+
+
+def remaining_timestamps(student_id=1):
+    with get_db() as conn:
+        rows = conn.execute("SELECT timestamp FROM metrics_history WHERE student_id = ? ORDER BY timestamp",
+                            (student_id,)).fetchall()
+    return [row["timestamp"] for row in rows]
+
+
+@pytest.fixture
+def archiver(db_path, tmp_path):
+    with get_db() as conn:
+        conn.execute("DELETE FROM metrics_history")
+        conn.commit()
+    return MetricsArchiver(archive_dir=str(tmp_path / "archives"), retention_days=30, chunk_size=2)
+
+
+def test_archives_old_rows_per_month(archiver, tmp_path):
+    old = ["2020-01-05 10:00:00", "2020-01-31 23:59:59", "2020-02-01 00:00:00", "2020-03-10 08:30:00"]
+    recent = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    insert_metrics(old + [recent])
+
+    assert archiver.archive_old_metrics() == 4
+    assert remaining_timestamps() == [recent]
+    assert sorted(path.name for path in (tmp_path / "archives" / "student_1").iterdir()) == \
+        ["2020-01.npz", "2020-02.npz", "2020-03.npz"]
+
+    rows = archiver.read(1, datetime(2020, 1, 1), datetime(2020, 4, 1))
+    assert [row["timestamp"] for row in rows] == old
+    assert rows[0]["cognitive_load"] == 40 and rows[0]["session_duration"] == 2
+
+    # A later run appends to the month file without losing what is there
+    insert_metrics(["2020-01-20 12:00:00"])
+    assert archiver.archive_old_metrics() == 1
+    rows = archiver.read(1, datetime(2020, 1, 1), datetime(2020, 2, 1))
+    assert [row["timestamp"] for row in rows] == [old[0], "2020-01-20 12:00:00", old[1]]
+
+
+def test_interrupted_run_does_not_duplicate_rows(archiver, monkeypatch):
+    insert_metrics(["2020-01-05 10:00:00", "2020-01-06 10:00:00"])
+
+    # The archive was written but the rows were never deleted
+    with get_db() as conn:
+        rows = conn.execute("SELECT * FROM metrics_history").fetchall()
+    archiver._append(1, "2020-01", rows)
+
+    assert archiver.archive_old_metrics() == 2
+    assert remaining_timestamps() == []
+    assert len(archiver.read(1, datetime(2020, 1, 1), datetime(2020, 2, 1))) == 2
+
+
+def test_one_process_archives_at_a_time(archiver, tmp_path):
+    insert_metrics(["2020-01-05 10:00:00"])
+    other = MetricsArchiver(archive_dir=str(tmp_path / "archives"), retention_days=30)
+
+    assert other._acquire_lease()
+    assert archiver.archive_old_metrics() == 0
+    assert remaining_timestamps() == ["2020-01-05 10:00:00"]
+
+    other._release_lease()
+    assert archiver.archive_old_metrics() == 1
+    # The lease is released at the end of the run
+    assert other._acquire_lease()
@@ -0,0 +1,35 @@
+import math
+
+import pytest
+
+from database import get_db
+from metrics_writer import apply_course_rollups, metrics_row
+
+
+def enrolled_courses(student_id=1):
+    with get_db() as conn:
+        rows = conn.execute("SELECT course_id, metrics_count FROM student_courses WHERE student_id = ?",
+                            (student_id,)).fetchall()
+    return {row["course_id"]: row["metrics_count"] or 0 for row in rows}
+
+
+def test_rollups_update_enrollments_only(db_path):
+    before = enrolled_courses()
+    enrolled = next(iter(before))
+    with get_db() as conn:
+        unenrolled = conn.execute("SELECT MAX(id) + 1 FROM courses").fetchone()[0]
+        conn.execute("INSERT INTO courses (id, title) VALUES (?, 'Unenrolled')", (unenrolled,))
+        apply_course_rollups(conn, [metrics_row(1, enrolled, 50, 60, 40, "focused"),
+                                    metrics_row(1, enrolled, 50, 60, 60, "focused"),
+                                    metrics_row(1, unenrolled, 50, 60, 40, "focused")])
+        conn.commit()
+
+    after = enrolled_courses()
+    assert after[enrolled] == before[enrolled] + 2
+    assert unenrolled not in after
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, "40", None, True])
+def test_metrics_row_rejects_values_that_cannot_be_aggregated(value):
+    with pytest.raises(ValueError):
+        metrics_row(1, 1, 50, 60, value, "focused")
@@ -0,0 +1,93 @@
+"""
+Query plans of the hot metrics_history queries.
+
+Calls the endpoints that read metrics_history against a migrated database
+and runs EXPLAIN QUERY PLAN on every statement they issue against it. No
+statement may sort in a temp B-tree or scan metrics_history without an
+index, and every index in METRICS_INDEX_PLAN must be used.
+"""
+import asyncio
+import re
+
+import pytest
+
+import main
+from database import get_db, METRICS_INDEX_PLAN
+
+# Endpoint calls whose metrics_history queries must stay index-only ordered
+ENDPOINT_CALLS = [
+    ("student dashboard", "get_student_dashboard", dict(student_id=1)),
+    ("metrics history", "get_student_metrics_history", dict(student_id=1, course_id=None, limit=50)),
+    ("metrics history by course", "get_student_metrics_history", dict(student_id=1, course_id=1, limit=50)),
+    ("raw timeline", "get_student_metrics_timeline",
+     dict(student_id=1, start="2026-01-01T00:00:00", end="2026-01-01T00:30:00", course_id=None, resolution="raw")),
+    ("raw timeline by course", "get_student_metrics_timeline",
+     dict(student_id=1, start="2026-01-01T00:00:00", end="2026-01-01T00:30:00", course_id=1, resolution="raw")),
+    ("student analytics", "get_student_analytics", dict(student_id=1)),
+    ("bulk analytics", "get_bulk_student_analytics", dict(student_ids=None, offset=0, limit=100)),
+    ("dashboard analytics", "get_dashboard_analytics", dict())
+]
+
+
+@pytest.fixture
+def metrics_db(db_path):
+    with get_db() as conn:
+        conn.execute("""
+            INSERT INTO metrics_history
+            (student_id, course_id, timestamp, gaze_score, face_attention, cognitive_load,
+             emotional_state, progress, session_duration)
+            VALUES (1, 1, '2026-01-01 00:10:00', 50, 50, 50, 'focused', 0, 2)
+        """)
+        conn.commit()
+    return db_path
+
+
+def metrics_queries(function: str, kwargs: dict):
+    """The metrics_history reads issued by one endpoint call"""
+    statements = []
+    with get_db() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        asyncio.run(getattr(main, function)(**kwargs))
+    finally:
+        with get_db() as conn:
+            conn.set_trace_callback(None)
+    return [sql for sql in statements
+            if "metrics_history" in sql and sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+
+def query_plan(sql: str):
+    with get_db() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def plan_problems(sql: str):
+    """Steps of a statement's plan that sort or scan metrics_history without an index"""
+    # metrics_history and the aliases it is queried under
+    names = {"metrics_history"} | set(re.findall(r"metrics_history\s+(?:AS\s+)?(?!WHERE|ORDER|JOIN)(\w+)", sql, re.I))
+    problems = []
+    for detail in query_plan(sql):
+        words = detail.split()
+        if "USE TEMP B-TREE" in detail:
+            problems.append(detail)
+        elif words[0] == "SCAN" and words[1] in names and "INDEX" not in detail:
+            problems.append(detail)
+    return problems
+
+
+@pytest.mark.parametrize("function, kwargs", [call[1:] for call in ENDPOINT_CALLS],
+                         ids=[call[0] for call in ENDPOINT_CALLS])
+def test_metrics_queries_use_indexes(metrics_db, function, kwargs):
+    queries = metrics_queries(function, kwargs)
+    assert queries, "no metrics_history query was issued"
+    for sql in queries:
+        assert plan_problems(sql) == [], " ".join(sql.split())
+
+
+def test_every_planned_index_is_used(metrics_db):
+    details = []
+    for _, function, kwargs in ENDPOINT_CALLS:
+        for sql in metrics_queries(function, kwargs):
+            details.extend(query_plan(sql))
+    for index_name, _ in METRICS_INDEX_PLAN:
+        assert any(index_name in detail for detail in details), f"{index_name} is not used"
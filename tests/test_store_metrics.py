@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import get_db
+
+
+@pytest.fixture
+def client(db_path):
+    return TestClient(main.app)
+
+
+def metrics_count(student_id=1):
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM metrics_history WHERE student_id = ?", (student_id,)).fetchone()[0]
+
+
+def test_stores_valid_metrics(client):
+    before = metrics_count()
+    response = client.post("/students/1/store_metrics",
+                           json={"gaze_score": 70, "face_attention": 80, "cognitive_load": 40,
+                                 "emotional_state": "focused", "progress": 5})
+    assert response.status_code == 200
+    assert metrics_count() == before + 1
+
+
+@pytest.mark.parametrize("body", [
+    '{"cognitive_load": NaN}',
+    '{"gaze_score": Infinity}',
+    '{"session_duration": -Infinity}',
+    '{"face_attention": "high"}',
+    '{"emotional_state": 3}'
+])
+def test_rejects_invalid_metrics_with_422(client, body):
+    before = metrics_count()
+    response = client.post("/students/1/store_metrics", content=body,
+                           headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    assert metrics_count() == before
@@ -0,0 +1,251 @@
+import io
+import os
+import zlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Extracted texts longer than this (in bytes) are stored zlib-compressed
+TEXT_COMPRESS_BYTES = int(os.getenv("TEXT_COMPRESS_BYTES", "4096"))
+
+
+def pack_text(text: str) -> Tuple[bytes, int]:
+    """Encode a text for storage: (data, compressed flag)"""
+    data = text.encode("utf-8")
+    if len(data) > TEXT_COMPRESS_BYTES:
+        return zlib.compress(data, 6), 1
+    return data, 0
+
+
+def unpack_text(data: bytes, compressed: int) -> str:
+    """Decode a text stored by pack_text"""
+    if compressed:
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """Text of every page of a PDF, one page per line block"""
+    import PyPDF2
+
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+    extracted_text = ""
+    for page in pdf_reader.pages:
+        extracted_text += page.extract_text() + "\n"
+    return extracted_text.strip()
+
+
+def extract_labeled_pdf_text(data: bytes) -> str:
+    """Text of the non-empty pages of a PDF, each under a "--- Page N ---" marker"""
+    import PyPDF2
+
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+    extracted_text = ""
+    for page_num, page in enumerate(pdf_reader.pages):
+        try:
+            page_text = page.extract_text()
+            if page_text.strip():
+                extracted_text += f"\n--- Page {page_num + 1} ---\n"
+                extracted_text += page_text.strip() + "\n\n"
+        except Exception as e:
+            logger.error(f"Error extracting text from page {page_num + 1}: {e}")
+            continue
+    return extracted_text.strip()
+
+
+def decode_text_file(data: bytes) -> str:
+    """Text file contents, UTF-8 with a Latin-1 fallback"""
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+def extract_note_text(file_path: str, data: Optional[bytes] = None) -> str:
+    """Text of a note file (PDF or TXT), reading it from disk unless data is given"""
+    if data is None:
+        with open(file_path, "rb") as f:
+            data = f.read()
+    if file_path.lower().endswith(".pdf"):
+        return extract_pdf_text(data)
+    return decode_text_file(data)
+
+
+def save_note_text(conn, note_id: int, text: str, error: Optional[str] = None):
+    """Store the extracted text of a note, or why it could not be extracted (the caller commits)"""
+    data, compressed = pack_text(text)
+    conn.execute(
+        "INSERT OR REPLACE INTO note_texts (note_id, text, compressed, error) VALUES (?, ?, ?, ?)",
+        (note_id, data, compressed, error)
+    )
+
+
+class NoteExtractionError(Exception):
+    """Raised for a note whose file could not be parsed"""
+
+
+def load_note_text(student_id: int, note_id: int) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    (file path, stored text) of a student's note, or None if the note does not
+    exist. The text is None for notes whose extraction has not finished or
+    that were uploaded before texts were stored. Raises NoteExtractionError
+    for notes whose file could not be parsed.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT n.file_path, t.text, t.compressed, t.error
+            FROM notes n
+            LEFT JOIN note_texts t ON t.note_id = n.id
+            WHERE n.id = ? AND n.student_id = ?
+        """, (note_id, student_id))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        if row["error"] is not None:
+            raise NoteExtractionError(row["error"])
+        text = unpack_text(row["text"], row["compressed"]) if row["text"] is not None else None
+        return row["file_path"], text
+
+
+def store_note_text(note_id: int, file_path: str) -> str:
+    """
+    Extract a note's file and store the text (also the lazy backfill for older
+    notes). A file that can't be parsed is recorded as such and raises
+    NoteExtractionError; a missing or unreadable file raises OSError.
+    """
+    try:
+        text = extract_note_text(file_path)
+    except OSError:
+        raise
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        with get_db() as conn:
+            save_note_text(conn, note_id, "", error)
+            conn.commit()
+        logger.error(f"Could not extract text for note {note_id}: {error}")
+        raise NoteExtractionError(error) from e
+    with get_db() as conn:
+        save_note_text(conn, note_id, text)
+        conn.commit()
+    logger.info(f"Stored extracted text for note {note_id} ({len(text)} characters)")
+    return text
+
+
+class PageRangeError(ValueError):
+    """Raised when requested pages are outside the document"""
+
+
+def check_pages(pages: List[int], page_count: int):
+    """Raise PageRangeError unless every page number is in 1..page_count"""
+    out_of_range = [page for page in pages if not 1 <= page <= page_count]
+    if out_of_range:
+        raise PageRangeError(f"Page {out_of_range[0]} is out of range (the PDF has {page_count} pages)")
+
+
+def extract_pdf_pages(pdf_path: str, pages: Optional[List[int]] = None) -> Tuple[Dict[int, str], int]:
+    """
+    Extract some pages (1-based, every page when None) of a PDF file.
+    Uses PyPDF2, or pdfplumber when PyPDF2 is not installed.
+    Returns: (page number -> text, page count)
+    """
+    try:
+        import PyPDF2
+        pdf = PyPDF2.PdfReader(pdf_path)
+        close = None
+    except ImportError:
+        import pdfplumber
+        pdf = pdfplumber.open(pdf_path)
+        close = pdf.close
+
+    try:
+        page_count = len(pdf.pages)
+        if pages is None:
+            pages = list(range(1, page_count + 1))
+        check_pages(pages, page_count)
+        return {page: pdf.pages[page - 1].extract_text() or "" for page in pages}, page_count
+    finally:
+        if close:
+            close()
+
+
+def _lookup_course_pdf_pages(cursor, path: str, stat: os.stat_result, pages: Optional[List[int]]):
+    """
+    Stored pages of a course PDF for the file's current version.
+    Returns: (current, page number -> text, page count, missing pages), where
+    current is False when nothing is stored for this version of the file
+    """
+    cursor.execute("SELECT mtime_ns, size, page_count FROM course_pdf_texts WHERE path = ?", (path,))
+    row = cursor.fetchone()
+    if row is None or (row["mtime_ns"], row["size"]) != (stat.st_mtime_ns, stat.st_size):
+        return False, {}, None, pages
+
+    page_count = row["page_count"]
+    wanted = pages if pages is not None else list(range(1, page_count + 1))
+    check_pages(wanted, page_count)
+    texts = {}
+    if wanted:
+        cursor.execute("""
+            SELECT page, text, compressed FROM course_pdf_pages
+            WHERE path = ? AND page BETWEEN ? AND ?
+        """, (path, min(wanted), max(wanted)))
+        wanted_pages = set(wanted)
+        texts = {r["page"]: unpack_text(r["text"], r["compressed"])
+                 for r in cursor.fetchall() if r["page"] in wanted_pages}
+    return True, texts, page_count, [page for page in wanted if page not in texts]
+
+
+def read_course_pdf_pages(pdf_path: str, pages: Optional[List[int]] = None) -> Optional[Tuple[Dict[int, str], int]]:
+    """
+    Stored text of some pages (1-based, every page when None) of a course PDF,
+    or None unless all of them are stored for the file's current version.
+    Returns: (page number -> text, page count)
+    """
+    stat = os.stat(pdf_path)
+    with get_db() as conn:
+        current, texts, page_count, missing = _lookup_course_pdf_pages(
+            conn.cursor(), os.path.realpath(pdf_path), stat, pages)
+    if not current or missing:
+        return None
+    return texts, page_count
+
+
+def get_course_pdf_pages(pdf_path: str, pages: Optional[List[int]] = None) -> Tuple[Dict[int, str], int]:
+    """
+    Text of some pages (1-based, every page when None) of a course PDF.
+
+    Page texts are kept in course_pdf_pages, keyed by the file path and
+    valid while the file keeps the mtime and size recorded in
+    course_pdf_texts. Only pages that are not stored yet are extracted, so
+    the first page of a new PDF can be served before the rest is parsed.
+    Returns: (page number -> text, page count)
+    """
+    stat = os.stat(pdf_path)
+    path = os.path.realpath(pdf_path)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        current, texts, page_count, missing = _lookup_course_pdf_pages(cursor, path, stat, pages)
+        if current and not missing:
+            return texts, page_count
+
+        extracted, page_count = extract_pdf_pages(pdf_path, missing)
+        texts.update(extracted)
+
+        if not current:
+            # New or changed file: forget the pages of the old version
+            cursor.execute("DELETE FROM course_pdf_pages WHERE path = ?", (path,))
+            cursor.execute("""
+                INSERT OR REPLACE INTO course_pdf_texts (path, mtime_ns, size, page_count)
+                VALUES (?, ?, ?, ?)
+            """, (path, stat.st_mtime_ns, stat.st_size, page_count))
+        cursor.executemany(
+            "INSERT OR REPLACE INTO course_pdf_pages (path, page, text, compressed) VALUES (?, ?, ?, ?)",
+            [(path, page, *pack_text(text)) for page, text in extracted.items()]
+        )
+        conn.commit()
+        logger.info(f"Extracted {len(extracted)} of {page_count} pages from {pdf_path}")
+        return texts, page_count
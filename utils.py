@@ -1,10 +1,12 @@
-import cv2
-import mediapipe as mp
 import numpy as np
 import base64
-import math
-from typing import Tuple, List, Optional
-from collections import deque
+import os
+import time
+import threading
+from typing import Tuple, List, Optional, Union
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import logging
 
 # Configure logging
@@ -12,36 +14,131 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # -------------------- INIT --------------------
-mp_face_mesh = mp.solutions.face_mesh
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
+# OpenCV and MediaPipe are imported on first use (or by warm_up_analysis), so
+# processes that never analyze frames start quickly and without their memory
+cv2 = None
+mp_face_mesh = None
+mp_drawing = None
+mp_drawing_styles = None
+_vision_lock = threading.Lock()
+
+def load_vision_modules():
+    """Import cv2 and mediapipe into this module, once"""
+    global cv2, mp_face_mesh, mp_drawing, mp_drawing_styles
+    if mp_face_mesh is not None:
+        return
+    with _vision_lock:
+        if mp_face_mesh is not None:
+            return
+        import cv2 as _cv2
+        import mediapipe as mp
+        cv2 = _cv2
+        mp_drawing = mp.solutions.drawing_utils
+        mp_drawing_styles = mp.solutions.drawing_styles
+        mp_face_mesh = mp.solutions.face_mesh
+        logger.info("Loaded OpenCV and MediaPipe")
 
 # -------------------- LANDMARKS --------------------
 LEFT_IRIS = [474, 475, 476, 477]
 RIGHT_IRIS = [469, 470, 471, 472]
 LEFT_EYE_POINTS = [33, 160, 158, 133, 153, 144]
 RIGHT_EYE_POINTS = [362, 385, 387, 263, 373, 380]
+NOSE_TIP = 1
+
+# Outermost face oval points (forehead, chin, left and right cheek), used for the face ROI
+FACE_BOUNDS = [10, 152, 234, 454]
+
+# -------------------- PREPROCESSING --------------------
+# Frames wider than this are downscaled before analysis (0 keeps the full resolution)
+ANALYSIS_WIDTH = int(os.getenv("ANALYSIS_WIDTH", "640"))
+# Padding around the last face box, as a fraction of its size (0 disables ROI cropping)
+FACE_ROI_PADDING = float(os.getenv("FACE_ROI_PADDING", "0.5"))
+
+# Eye point pairs used for EAR, as positions in the eye lists: (p2, p6), (p3, p5), (p1, p4)
+EAR_PAIRS = [(1, 5), (2, 4), (0, 3)]
+
+# Every landmark the per-frame metrics read, in kernel row order: the first point
+# of each EAR pair for both eyes (6), the second point of each pair (6),
+# left iris (4), right iris (4) and nose tip (1). Keeping the pairs in two
+# aligned blocks lets all six eye distances come from one slice subtraction.
+METRIC_LANDMARKS = (
+    [eye[a] for eye in (LEFT_EYE_POINTS, RIGHT_EYE_POINTS) for a, _ in EAR_PAIRS] +
+    [eye[b] for eye in (LEFT_EYE_POINTS, RIGHT_EYE_POINTS) for _, b in EAR_PAIRS] +
+    LEFT_IRIS + RIGHT_IRIS + [NOSE_TIP]
+)
+
+# Landmarks reported for client-side debug overlays
+OVERLAY_LANDMARKS = {
+    "left_eye": LEFT_EYE_POINTS,
+    "right_eye": RIGHT_EYE_POINTS,
+    "left_iris": LEFT_IRIS,
+    "right_iris": RIGHT_IRIS,
+    "nose": [NOSE_TIP]
+}
+
+# Metric bars on the debug overlay, in drawing order, with BGR colors
+DEBUG_BARS = [
+    ("Gaze", (0, 255, 0)),
+    ("Attention", (255, 255, 0)),
+    ("Cognitive Load", (0, 0, 255)),
+    ("Engagement", (255, 0, 255))
+]
+
+def gather_landmarks(landmarks, w: int, h: int, out: np.ndarray, x0: int = 0, y0: int = 0) -> np.ndarray:
+    """
+    Copy the METRIC_LANDMARKS into a preallocated (N, 2) float32 array of pixel coordinates.
+    w/h are the size of the image the landmarks were detected in and x0/y0 its
+    offset in the full frame, so cropped detections map back to frame pixels.
+    """
+    for row, idx in enumerate(METRIC_LANDMARKS):
+        landmark = landmarks[idx]
+        out[row, 0] = landmark.x
+        out[row, 1] = landmark.y
+    out[:, 0] *= w
+    out[:, 1] *= h
+    # Truncate to whole pixels like the per-landmark int() conversion this replaced
+    np.trunc(out, out=out)
+    if x0 or y0:
+        out[:, 0] += x0
+        out[:, 1] += y0
+    return out
+
+def compute_landmark_metrics(points: np.ndarray, w: int, h: int) -> Tuple[float, float, np.ndarray, float, float]:
+    """
+    Compute both EARs, the iris centres and head yaw/pitch from gathered landmarks
+    Returns: (ear_left, ear_right, iris_centers[[left], [right]], yaw, pitch)
+    """
+    # All six eye distances at once: [vertical1, vertical2, horizontal] per eye
+    diffs = points[0:6] - points[6:12]
+    v1_left, v2_left, h_left, v1_right, v2_right, h_right = np.hypot(diffs[:, 0], diffs[:, 1]).tolist()
+    
+    # EAR = (vertical1 + vertical2) / (2 * horizontal), 0.3 when the eye has no width
+    ear_left = (v1_left + v2_left) / (2.0 * h_left) if h_left else 0.3
+    ear_right = (v1_right + v2_right) / (2.0 * h_right) if h_right else 0.3
+    
+    iris_centers = points[12:20].reshape(2, 4, 2).mean(axis=1)
+    
+    nose_x, nose_y = points[20].tolist()
+    yaw = (nose_x - w / 2) / w * 100
+    pitch = (nose_y - h / 2) / h * 100
+    
+    return ear_left, ear_right, iris_centers, yaw, pitch
 
 class CleanAnalyticsTracker:
     """
     Clean and efficient learning analytics tracker based on cog_anltycs.py
     """
-    def __init__(self, buffer_size=8, confidence_threshold=0.5):
+    def __init__(self, buffer_size=8, confidence_threshold=0.5,
+                 analysis_width=ANALYSIS_WIDTH, roi_padding=FACE_ROI_PADDING):
         self.buffer_size = buffer_size
         self.confidence_threshold = confidence_threshold
+        self.analysis_width = analysis_width
+        self.roi_padding = roi_padding
         
-        # Initialize MediaPipe Face Mesh
-        try:
-            self.face_mesh = mp_face_mesh.FaceMesh(
-                max_num_faces=1,
-                refine_landmarks=True,
-                min_detection_confidence=confidence_threshold,
-                min_tracking_confidence=confidence_threshold
-            )
-            logger.info("MediaPipe Face Mesh initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing MediaPipe Face Mesh: {e}")
-            self.face_mesh = None
+        # MediaPipe Face Mesh is created on first use so that trackers in
+        # processes that never analyze frames don't carry the graph
+        self._face_mesh = None
+        self._face_mesh_disabled = False
         
         # -------------------- SMOOTHING --------------------
         self.gaze_buffer = deque(maxlen=buffer_size)
@@ -54,43 +151,148 @@ class CleanAnalyticsTracker:
         self.last_valid_attention = 50.0
         self.last_valid_cognitive = 30.0
         self.last_valid_engagement = 40.0
-    
-    def get_point(self, landmarks, idx, w, h):
-        """Get landmark point as numpy array"""
-        return np.array([int(landmarks[idx].x * w), int(landmarks[idx].y * h)])
-    
-    def distance(self, p1, p2):
-        """Calculate distance between two points"""
-        return np.linalg.norm(p1 - p2)
-    
-    def compute_ear(self, landmarks, eye_points, w, h):
-        """Compute Eye Aspect Ratio for blink detection"""
-        p1 = self.get_point(landmarks, eye_points[0], w, h)
-        p2 = self.get_point(landmarks, eye_points[1], w, h)
-        p3 = self.get_point(landmarks, eye_points[2], w, h)
-        p4 = self.get_point(landmarks, eye_points[3], w, h)
-        p5 = self.get_point(landmarks, eye_points[4], w, h)
-        p6 = self.get_point(landmarks, eye_points[5], w, h)
-
-        vertical1 = self.distance(p2, p6)
-        vertical2 = self.distance(p3, p5)
-        horizontal = self.distance(p1, p4)
-
-        if horizontal == 0:
-            return 0.3  # Default value
         
-        return (vertical1 + vertical2) / (2.0 * horizontal)
+        # Detection stability counters
+        self.consecutive_detections = 0
+        self.consecutive_misses = 0
+        
+        # Landmarks of the last detected face, kept for debug overlays, and the
+        # region they were detected in as normalized (x, y, width, height)
+        self.last_face = None
+        self.last_region = (0.0, 0.0, 1.0, 1.0)
+        
+        # Padded face box (x0, y0, x1, y1) in analysis-frame pixels, None when
+        # the next frame has to be searched in full
+        self.roi = None
+        self.roi_changed = False
+        
+        # Reused for every frame by the landmark metrics kernel
+        self.landmark_points = np.empty((len(METRIC_LANDMARKS), 2), dtype=np.float32)
+        
+        # FaceMesh graphs are not thread-safe, serialize access per tracker
+        self.lock = threading.Lock()
     
-    def iris_center(self, landmarks, iris_idx, w, h):
-        """Calculate iris center from iris landmarks"""
-        pts = [self.get_point(landmarks, i, w, h) for i in iris_idx]
-        return np.mean(pts, axis=0)
+    @property
+    def face_mesh(self):
+        """MediaPipe Face Mesh graph, initialized lazily"""
+        if self._face_mesh is None and not self._face_mesh_disabled:
+            try:
+                load_vision_modules()
+                self._face_mesh = mp_face_mesh.FaceMesh(
+                    max_num_faces=1,
+                    refine_landmarks=True,
+                    min_detection_confidence=self.confidence_threshold,
+                    min_tracking_confidence=self.confidence_threshold
+                )
+                logger.info("MediaPipe Face Mesh initialized successfully")
+            except Exception as e:
+                logger.error(f"Error initializing MediaPipe Face Mesh: {e}")
+                self._face_mesh_disabled = True
+        return self._face_mesh
+    
+    @property
+    def is_stable(self) -> bool:
+        """Tracker is stable once the smoothing buffers hold enough consecutive detections"""
+        return self.consecutive_detections >= self.buffer_size
+    
+    def close(self):
+        """Release the MediaPipe graph"""
+        if self._face_mesh is not None:
+            self._face_mesh.close()
+            self._face_mesh = None
+        self._face_mesh_disabled = True
     
     def smooth(self, buffer, value):
         """Apply smoothing using moving average"""
         buffer.append(value)
         return sum(buffer) / len(buffer)
     
+    def analysis_scale(self, img: np.ndarray) -> float:
+        """Factor that brings a frame down to the analysis resolution"""
+        w = img.shape[1]
+        if self.analysis_width and w > self.analysis_width:
+            return self.analysis_width / w
+        return 1.0
+    
+    def prepare_region(self, img: np.ndarray, scale: float, w: int, h: int,
+                       box: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        """
+        Cut a box (in analysis-frame pixels) out of the full-resolution frame and
+        downscale it to the analysis resolution. Cropping before resizing keeps
+        the resize cost proportional to the face, not the webcam resolution.
+        """
+        if box is None:
+            region, size = img, (w, h)
+        else:
+            x0, y0, x1, y1 = box
+            region = img[int(y0 / scale):int(y1 / scale), int(x0 / scale):int(x1 / scale)]
+            size = (x1 - x0, y1 - y0)
+        if scale < 1.0:
+            region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        return region
+    
+    def detect_face(self, img: np.ndarray, scale: float, w: int, h: int):
+        """
+        Run FaceMesh on the padded face ROI from the previous frame, falling back
+        to the full frame when there is no ROI or the face was lost in it.
+        Returns: (landmarks or None, (x0, y0, width, height) of the searched region
+        in analysis-frame pixels)
+        """
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            region = (x0, y0, x1 - x0, y1 - y0)
+            crop = self.prepare_region(img, scale, w, h, self.roi)
+            face = self.process_image(crop)
+            if face is None and self.roi_changed:
+                # FaceMesh is still tracking in the previous region's coordinates, so
+                # the first frame after a region change can miss; retrying detects afresh
+                face = self.process_image(crop)
+            self.roi_changed = False
+            if face is not None:
+                self.update_roi(face, region, w, h)
+                return face, region
+            self.roi = None
+        
+        region = (0, 0, w, h)
+        face = self.process_image(self.prepare_region(img, scale, w, h))
+        if face is not None:
+            self.update_roi(face, region, w, h)
+        return face, region
+    
+    def process_image(self, img: np.ndarray):
+        """Run FaceMesh on a BGR image and return the first face's landmarks, if any"""
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        results = self.face_mesh.process(rgb)
+        if results.multi_face_landmarks:
+            return results.multi_face_landmarks[0].landmark
+        return None
+    
+    def update_roi(self, face, region: Tuple[int, int, int, int], w: int, h: int):
+        """Track a padded box around the face for the next frame"""
+        if self.roi_padding <= 0:
+            return
+        
+        rx, ry, rw, rh = region
+        xs = [rx + face[i].x * rw for i in FACE_BOUNDS]
+        ys = [ry + face[i].y * rh for i in FACE_BOUNDS]
+        fx0, fx1, fy0, fy1 = min(xs), max(xs), min(ys), max(ys)
+        
+        # Keep the current ROI while the face stays well inside it, so FaceMesh
+        # keeps getting a stable input and can track instead of re-detecting
+        if self.roi is not None:
+            margin = self.roi_padding / 2 * max(fx1 - fx0, fy1 - fy0)
+            x0, y0, x1, y1 = self.roi
+            if (fx0 - margin >= x0 and fy0 - margin >= y0 and
+                    fx1 + margin <= x1 and fy1 + margin <= y1):
+                return
+        
+        pad = self.roi_padding * max(fx1 - fx0, fy1 - fy0)
+        self.roi_changed = True
+        self.roi = (
+            max(0, int(fx0 - pad)), max(0, int(fy0 - pad)),
+            min(w, int(fx1 + pad) + 1), min(h, int(fy1 + pad) + 1)
+        )
+    
     def analyze_frame(self, img: np.ndarray, student_cognitive_limit: int = 50) -> Tuple[float, float, float, float, bool]:
         """
         Analyze a single frame for learning analytics
@@ -100,9 +302,11 @@ class CleanAnalyticsTracker:
             logger.error("MediaPipe Face Mesh not initialized")
             return self.get_fallback_values()
         
-        h, w, _ = img.shape
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        results = self.face_mesh.process(rgb)
+        # Work at the analysis resolution, in the face ROI when one is known
+        scale = self.analysis_scale(img)
+        h = max(1, round(img.shape[0] * scale))
+        w = max(1, round(img.shape[1] * scale))
+        face, (rx, ry, rw, rh) = self.detect_face(img, scale, w, h)
 
         # Default values
         gaze_score = 0
@@ -111,13 +315,16 @@ class CleanAnalyticsTracker:
         engagement = 0
         face_detected = False
 
-        if results.multi_face_landmarks:
-            face = results.multi_face_landmarks[0].landmark
+        if face is not None:
             face_detected = True
+            self.last_face = face
+            self.last_region = (rx / w, ry / h, rw / w, rh / h)
+
+            # -------- LANDMARK METRICS --------
+            points = gather_landmarks(face, rw, rh, self.landmark_points, rx, ry)
+            ear_left, ear_right, _, yaw, pitch = compute_landmark_metrics(points, w, h)
 
             # -------- EAR --------
-            ear_left = self.compute_ear(face, LEFT_EYE_POINTS, w, h)
-            ear_right = self.compute_ear(face, RIGHT_EYE_POINTS, w, h)
             ear = (ear_left + ear_right) / 2.0
 
             eye_opening = np.clip((ear - 0.15) / (0.35 - 0.15), 0, 1)
@@ -126,9 +333,6 @@ class CleanAnalyticsTracker:
             blink = ear < 0.18
 
             # -------- HEAD POSE --------
-            nose = self.get_point(face, 1, w, h)
-            yaw = (nose[0] - w / 2) / w * 100
-            pitch = (nose[1] - h / 2) / h * 100
             head_penalty = min(25, (abs(yaw) + abs(pitch)) / 2.5)
 
             # -------- METRICS --------
@@ -157,11 +361,15 @@ class CleanAnalyticsTracker:
             self.last_valid_attention = attention_score
             self.last_valid_cognitive = cognitive_load
             self.last_valid_engagement = engagement
+            self.consecutive_detections += 1
+            self.consecutive_misses = 0
 
             logger.info(f"Face detected - Gaze: {gaze_score:.1f}%, Attention: {attention_score:.1f}%, "
                        f"Cognitive: {cognitive_load:.1f}%, Engagement: {engagement:.1f}%")
         else:
             logger.info("No face detected")
+            self.consecutive_detections = 0
+            self.consecutive_misses += 1
             return self.get_fallback_values()
 
         return gaze_score, attention_score, cognitive_load, engagement, face_detected
@@ -177,9 +385,11 @@ class CleanAnalyticsTracker:
         )
     
     def draw_debug_overlay(self, img: np.ndarray, gaze_score: float, attention_score: float, 
-                          cognitive_load: float, engagement: float, face_detected: bool) -> np.ndarray:
-        """Draw debug overlay with metrics visualization"""
-        overlay_img = img.copy()
+                          cognitive_load: float, engagement: float, face_detected: bool,
+                          copy: bool = True) -> np.ndarray:
+        """Draw debug overlay with metrics visualization (in place when copy is False)"""
+        load_vision_modules()
+        overlay_img = img.copy() if copy else img
         
         def draw_bar(y, label, value, color):
             cv2.putText(overlay_img, f"{label}: {int(value)}%", (10, y),
@@ -187,10 +397,9 @@ class CleanAnalyticsTracker:
             cv2.rectangle(overlay_img, (150, y - 15),
                          (150 + int(value * 2), y - 5), color, -1)
 
-        draw_bar(30, "Gaze", gaze_score, (0, 255, 0))
-        draw_bar(60, "Attention", attention_score, (255, 255, 0))
-        draw_bar(90, "Cognitive Load", cognitive_load, (0, 0, 255))
-        draw_bar(120, "Engagement", engagement, (255, 0, 255))
+        values = [gaze_score, attention_score, cognitive_load, engagement]
+        for i, ((label, color), value) in enumerate(zip(DEBUG_BARS, values)):
+            draw_bar(30 * (i + 1), label, value, color)
         
         # Add face detection status
         status_text = "Face Detected" if face_detected else "No Face"
@@ -199,70 +408,353 @@ class CleanAnalyticsTracker:
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
         
         return overlay_img
+    
+    def get_overlay_data(self, gaze_score: float, attention_score: float,
+                         cognitive_load: float, engagement: float, face_detected: bool) -> dict:
+        """Debug overlay as data (bar values and normalized landmarks) for client-side drawing"""
+        values = [gaze_score, attention_score, cognitive_load, engagement]
+        landmarks = {}
+        if face_detected and self.last_face is not None:
+            # Map landmarks from the detection region back to the full frame
+            rx, ry, rw, rh = self.last_region
+            landmarks = {
+                name: [[rx + self.last_face[i].x * rw, ry + self.last_face[i].y * rh] for i in points]
+                for name, points in OVERLAY_LANDMARKS.items()
+            }
+        
+        return {
+            "bars": [
+                {"label": label, "value": float(value), "color": "#%02x%02x%02x" % (color[2], color[1], color[0])}
+                for (label, color), value in zip(DEBUG_BARS, values)
+            ],
+            "face_detected": face_detected,
+            "landmarks": landmarks
+        }
 
-# Global tracker instance
+class TrackerPool:
+    """
+    Keyed pool of per-student trackers so every session keeps its own
+    FaceMesh graph and smoothing buffers. Least recently used trackers are
+    evicted once the pool is full, and trackers idle for longer than
+    idle_timeout seconds are dropped on the next access. Trackers leased
+    with use() (or whose lock is held) are never evicted, so a frame is
+    always analyzed and reported by the same live tracker; when every
+    tracker is busy the pool briefly grows past max_trackers instead.
+    """
+    def __init__(self, max_trackers: int = 32, idle_timeout: float = 300.0,
+                 buffer_size: int = 8, confidence_threshold: float = 0.5):
+        self.max_trackers = max_trackers
+        self.idle_timeout = idle_timeout
+        self.buffer_size = buffer_size
+        self.confidence_threshold = confidence_threshold
+        
+        # student_id -> [tracker, last_used, leases], ordered from least to most recently used
+        self._trackers: "OrderedDict[int, list]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def use(self, student_id: int):
+        """Lease the tracker for a student; it stays in the pool until released"""
+        tracker = self._acquire(student_id)
+        try:
+            yield tracker
+        finally:
+            self._release(student_id, tracker)
+    
+    def _acquire(self, student_id: int) -> CleanAnalyticsTracker:
+        now = time.monotonic()
+        
+        with self._lock:
+            evicted = self._pop_idle(now)
+            
+            entry = self._trackers.pop(student_id, None)
+            if entry is None:
+                evicted.extend(self._pop_least_recent(len(self._trackers) + 1 - self.max_trackers))
+                entry = [CleanAnalyticsTracker(self.buffer_size, self.confidence_threshold), now, 0]
+                logger.info(f"Created tracker for student {student_id} ({len(self._trackers) + 1} active)")
+            
+            entry[1] = now
+            entry[2] += 1
+            self._trackers[student_id] = entry
+        
+        self._close_all(evicted)
+        return entry[0]
+    
+    def _release(self, student_id: int, tracker: CleanAnalyticsTracker):
+        with self._lock:
+            entry = self._trackers.get(student_id)
+            if entry is not None and entry[0] is tracker:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+                self._trackers.move_to_end(student_id)
+    
+    def remove(self, student_id: int):
+        """Drop a student's tracker, e.g. when their session ends (waits for a running frame)"""
+        with self._lock:
+            entry = self._trackers.pop(student_id, None)
+        if entry is not None:
+            self._close_all([entry[0]])
+    
+    def evict_idle(self) -> int:
+        """Drop trackers that have been idle for longer than idle_timeout"""
+        with self._lock:
+            evicted = self._pop_idle(time.monotonic())
+        self._close_all(evicted)
+        return len(evicted)
+    
+    def clear(self):
+        """Drop every tracker in the pool"""
+        with self._lock:
+            evicted = [entry[0] for entry in self._trackers.values()]
+            self._trackers.clear()
+        self._close_all(evicted)
+    
+    def __len__(self) -> int:
+        return len(self._trackers)
+    
+    def __contains__(self, student_id: int) -> bool:
+        return student_id in self._trackers
+    
+    @staticmethod
+    def _in_use(entry: list) -> bool:
+        return entry[2] > 0 or entry[0].lock.locked()
+    
+    def _pop_idle(self, now: float) -> List[CleanAnalyticsTracker]:
+        """Remove idle entries that are not in use; caller must hold the pool lock"""
+        evicted = []
+        for student_id, entry in list(self._trackers.items()):
+            if now - entry[1] <= self.idle_timeout:
+                break
+            if self._in_use(entry):
+                continue
+            del self._trackers[student_id]
+            evicted.append(entry[0])
+        return evicted
+    
+    def _pop_least_recent(self, count: int) -> List[CleanAnalyticsTracker]:
+        """Remove up to count least recently used entries that are not in use; caller must hold the pool lock"""
+        evicted = []
+        for student_id, entry in list(self._trackers.items()):
+            if len(evicted) >= count:
+                break
+            if self._in_use(entry):
+                continue
+            del self._trackers[student_id]
+            evicted.append(entry[0])
+        return evicted
+    
+    def _close_all(self, trackers: List[CleanAnalyticsTracker]):
+        """Close evicted trackers once nobody is analyzing with them"""
+        for tracker in trackers:
+            with tracker.lock:
+                tracker.close()
+
+# Global tracker instances
 clean_tracker = CleanAnalyticsTracker()
+tracker_pool = TrackerPool(
+    max_trackers=int(os.getenv("TRACKER_POOL_SIZE", "32")),
+    idle_timeout=float(os.getenv("TRACKER_IDLE_TIMEOUT", "300"))
+)
 
-def analyze_face_from_image(image_data: str, student_cognitive_limit: int = 50) -> Tuple[float, float, float, float, bool]:
+@contextmanager
+def use_tracker(student_id: Optional[int] = None):
+    """Lease the tracker for a student (or the shared tracker) for the duration of a job"""
+    if student_id is None:
+        yield clean_tracker
+        return
+    with tracker_pool.use(student_id) as tracker:
+        yield tracker
+
+def decode_image(image_data: Union[str, bytes]) -> Optional[np.ndarray]:
+    """
+    Decode a frame into a BGR image. Strings are treated as base64 (optionally
+    a data URL), bytes as an encoded JPEG/PNG that needs no base64 step.
+    """
+    load_vision_modules()
+    if isinstance(image_data, str):
+        image_data = image_data.split(',')[1] if ',' in image_data else image_data
+        image_data = base64.b64decode(image_data)
+    nparr = np.frombuffer(image_data, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def analyze_face_from_image(image_data: Union[str, bytes], student_cognitive_limit: int = 50,
+                            student_id: Optional[int] = None) -> Tuple[float, float, float, float, bool]:
     """
     Main face analysis function using clean analytics approach
     Returns: (gaze_score, attention_score, cognitive_load, engagement_level, face_detected)
     All scores are in 0-100 range
     """
+    with use_tracker(student_id) as tracker:
+        return analyze_face_with_tracker(tracker, image_data, student_cognitive_limit)
+
+def analyze_face_with_tracker(tracker: CleanAnalyticsTracker, image_data: Union[str, bytes],
+                              student_cognitive_limit: int = 50) -> Tuple[float, float, float, float, bool]:
+    """analyze_face_from_image with a tracker the caller has already leased"""
     try:
         # Decode image
-        image_data = image_data.split(',')[1] if ',' in image_data else image_data
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img = decode_image(image_data)
         
         if img is None:
             logger.error("Failed to decode image")
-            return clean_tracker.get_fallback_values()
+            return tracker.get_fallback_values()
         
-        # Analyze using clean tracker
-        return clean_tracker.analyze_frame(img, student_cognitive_limit)
+        # Analyze using the student's own tracker
+        with tracker.lock:
+            return tracker.analyze_frame(img, student_cognitive_limit)
         
     except Exception as e:
         logger.error(f"Error in face analysis: {e}")
-        return clean_tracker.get_fallback_values()
+        return tracker.get_fallback_values()
 
-def analyze_face_with_debug_overlay(image_data: str, student_cognitive_limit: int = 50) -> \
-        Tuple[float, float, float, float, bool, str]:
+def analyze_face_with_debug_overlay(image_data: Union[str, bytes], student_cognitive_limit: int = 50,
+                                    student_id: Optional[int] = None, encode_base64: bool = True,
+                                    overlay_scale: float = 1.0, overlay_quality: int = 95) -> \
+        Tuple[float, float, float, float, bool, Union[str, bytes]]:
     """
     Analyze face with debug overlay using clean analytics
+    The frame is decoded once and the same array is analyzed and drawn on.
+    overlay_scale (0-1] downsizes the overlay and overlay_quality sets its JPEG quality.
     Returns: (gaze, attention, cognitive, engagement, face_detected, debug_image_base64)
+    With encode_base64=False the debug image is returned as raw JPEG bytes instead.
     """
+    with use_tracker(student_id) as tracker:
+        return analyze_face_with_tracker_overlay(tracker, image_data, student_cognitive_limit,
+                                                 encode_base64, overlay_scale, overlay_quality)
+
+def analyze_face_with_tracker_overlay(tracker: CleanAnalyticsTracker, image_data: Union[str, bytes],
+                                      student_cognitive_limit: int = 50, encode_base64: bool = True,
+                                      overlay_scale: float = 1.0, overlay_quality: int = 95) -> \
+        Tuple[float, float, float, float, bool, Union[str, bytes]]:
+    """analyze_face_with_debug_overlay with a tracker the caller has already leased"""
     try:
+        img = decode_image(image_data)
+        
+        if img is None:
+            logger.error("Failed to decode image")
+            gaze, attention, cognitive, engagement, _ = tracker.get_fallback_values()
+            return gaze, attention, cognitive, engagement, False, ""
+        
         # Perform regular analysis
-        gaze, attention, cognitive, engagement, face_detected = analyze_face_from_image(
-            image_data, student_cognitive_limit)
+        with tracker.lock:
+            gaze, attention, cognitive, engagement, face_detected = tracker.analyze_frame(
+                img, student_cognitive_limit)
         
-        # Generate debug overlay
+        # Generate debug overlay on the decoded frame, which is no longer needed as-is
         debug_image_base64 = ""
         if face_detected:
-            # Decode image for overlay
-            image_data_clean = image_data.split(',')[1] if ',' in image_data else image_data
-            image_bytes = base64.b64decode(image_data_clean)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            debug_img = tracker.draw_debug_overlay(
+                img, gaze, attention, cognitive, engagement, face_detected, copy=False)
+            
+            if 0 < overlay_scale < 1.0:
+                debug_img = cv2.resize(debug_img, None, fx=overlay_scale, fy=overlay_scale,
+                                       interpolation=cv2.INTER_AREA)
             
-            if img is not None:
-                # Draw overlay
-                debug_img = clean_tracker.draw_debug_overlay(
-                    img, gaze, attention, cognitive, engagement, face_detected)
-                
-                # Convert back to base64
-                _, buffer = cv2.imencode('.jpg', debug_img)
+            # Convert back to JPEG, base64 encoded unless raw bytes were requested
+            _, buffer = cv2.imencode('.jpg', debug_img, [cv2.IMWRITE_JPEG_QUALITY, int(overlay_quality)])
+            if encode_base64:
                 debug_image_base64 = base64.b64encode(buffer).decode('utf-8')
+            else:
+                debug_image_base64 = buffer.tobytes()
         
         return gaze, attention, cognitive, engagement, face_detected, debug_image_base64
         
     except Exception as e:
         logger.error(f"Error in face analysis with debug: {e}")
-        gaze, attention, cognitive, engagement, _ = clean_tracker.get_fallback_values()
+        gaze, attention, cognitive, engagement, _ = tracker.get_fallback_values()
         return gaze, attention, cognitive, engagement, False, ""
 
+def run_analysis_job(image_data: Union[str, bytes], student_cognitive_limit: int = 50,
+                     student_id: Optional[int] = None, debug: bool = False,
+                     encode_base64: bool = True, overlay_mode: str = "image",
+                     overlay_scale: float = 1.0, overlay_quality: int = 95) -> dict:
+    """
+    Analyze one frame and report the tracker state alongside the metrics.
+    Entry point for inference workers, so it only takes and returns picklable values.
+    With debug set, overlay_mode "image" renders the overlay JPEG and "data"
+    returns the overlay as bar values and landmarks instead.
+    """
+    overlay = None
+    # One lease for the whole job, so the result reports the tracker that analyzed the frame
+    with use_tracker(student_id) as tracker:
+        if debug and overlay_mode == "image":
+            gaze, attention, cognitive, engagement, face_detected, debug_image = analyze_face_with_tracker_overlay(
+                tracker, image_data, student_cognitive_limit, encode_base64, overlay_scale, overlay_quality)
+        else:
+            gaze, attention, cognitive, engagement, face_detected = analyze_face_with_tracker(
+                tracker, image_data, student_cognitive_limit)
+            debug_image = ""
+        
+        if debug and overlay_mode == "data":
+            with tracker.lock:
+                overlay = tracker.get_overlay_data(gaze, attention, cognitive, engagement, face_detected)
+        
+        return build_job_result(tracker, (gaze, attention, cognitive, engagement, face_detected),
+                                debug_image, overlay)
+
+def build_job_result(tracker: CleanAnalyticsTracker, metrics: Tuple[float, float, float, float, bool],
+                     debug_image: Union[str, bytes] = "", overlay: Optional[dict] = None) -> dict:
+    """Metrics dict returned by the inference jobs"""
+    gaze, attention, cognitive, engagement, face_detected = metrics
+    return {
+        "gaze_score": float(gaze),
+        "face_attention_score": float(attention),
+        "cognitive_load": float(cognitive),
+        "engagement_level": float(engagement),
+        "face_detected": bool(face_detected),
+        "debug_image": debug_image,
+        "overlay": overlay,
+        "tracker_stable": tracker.is_stable,
+        "consecutive_detections": tracker.consecutive_detections,
+        "consecutive_misses": tracker.consecutive_misses
+    }
+
+def warm_up_analysis():
+    """
+    Load the vision modules and the shared tracker's FaceMesh graph ahead of
+    the first frame. Also used to warm up inference workers.
+    """
+    load_vision_modules()
+    with clean_tracker.lock:
+        return clean_tracker.face_mesh is not None
+
+# Threads used to decode batched frames; cv2.imdecode releases the GIL
+_decode_pool: Optional[ThreadPoolExecutor] = None
+
+def safe_decode_image(image_data: Union[str, bytes]) -> Optional[np.ndarray]:
+    """decode_image that logs and returns None instead of raising"""
+    try:
+        return decode_image(image_data)
+    except Exception as e:
+        logger.error(f"Failed to decode image: {e}")
+        return None
+
+def run_analysis_batch_job(images: List[Union[str, bytes]], student_cognitive_limit: int = 50,
+                           student_id: Optional[int] = None) -> List[dict]:
+    """
+    Analyze several frames of one student. Frames are decoded in parallel and
+    then fed through the student's tracker in order, so smoothing matches
+    sending them one by one. Entry point for inference workers.
+    """
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(max_workers=int(os.getenv("DECODE_THREADS", "4")),
+                                          thread_name_prefix="decode")
+    decoded = list(_decode_pool.map(safe_decode_image, images))
+    
+    results = []
+    with use_tracker(student_id) as tracker, tracker.lock:
+        for img in decoded:
+            if img is None:
+                metrics = tracker.get_fallback_values()
+            else:
+                try:
+                    metrics = tracker.analyze_frame(img, student_cognitive_limit)
+                except Exception as e:
+                    logger.error(f"Error in face analysis: {e}")
+                    metrics = tracker.get_fallback_values()
+            results.append(build_job_result(tracker, metrics))
+    return results
+
 # Legacy functions for backward compatibility
 def calculate_cognitive_load(gaze_score: float, student_cognitive_limit: int) -> float:
     """Legacy cognitive load calculation"""